@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the cold start of the plugin entry point in fresh interpreters.
+Exits with status 1 when the median import time exceeds addon.COLD_START_BUDGET, or when a route that
+doesn't need the network (a dialog, a replayed listing) creates the Viaplay client.
+Usage: python benchmarks/coldstart.py [runs]
+For a per-module breakdown, run the snippet below with python -X importtime.
+"""
+import os
+import sys
+import json
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SNIPPET = '''
+import sys, time, json
+sys.path.insert(0, {bench_dir!r})
+import kodistubs
+kodistubs.install()
+del sys.modules['inputstreamhelper']  # must not be imported before playback
+started = time.time()
+from resources.lib import addon
+imported = time.time()
+print(json.dumps({{'import_ms': (imported - started) * 1000, 'budget_ms': addon.COLD_START_BUDGET,
+                  'modules': sorted(m for m in ('requests', 'iso8601') if m in sys.modules)}}))
+'''
+# dispatches a route through addon.run(), with its listing stored beforehand when one is given
+DISPATCH_SNIPPET = '''
+import sys, time, json
+sys.path.insert(0, {bench_dir!r})
+import kodistubs
+kodistubs.install()
+kodistubs.Addon.settings.update({{'store_listings': 'true', 'prefetch': 'true'}})
+sys.argv = [{route!r}, '1', {query!r}]
+if {listing!r}:
+    import os
+    from resources.lib.listings import ListingStore
+    key = ListingStore.make_key({route!r} + {query!r}, lambda x: kodistubs.Addon.settings.get(x, ''))
+    ListingStore(os.path.join(kodistubs.PROFILE_DIR, 'listings.db')).set(key, {listing!r}, time.time())
+started = time.time()
+from resources.lib import addon
+addon.run(started)
+print(json.dumps({{'total_ms': (time.time() - started) * 1000, 'client_created': addon.helper._vp is not None}}))
+'''
+# routes that must not create the Viaplay client: (plugin URL, query, stored listing)
+DISPATCH_ROUTES = [
+    ('plugin://plugin.video.viaplay/dialog', '?dialog_type=ok&heading=Viaplay&message=Hello', None),
+    ('plugin://plugin.video.viaplay/vod', '?url=https://content.viaplay.se/xdk-se/serier', {
+        'items': [{'title': 'Categories', 'url': 'plugin://plugin.video.viaplay/categories?url=x', 'folder': True,
+                   'playable': False, 'info': None, 'art': None, 'content': False}],
+        'cache_to_disc': True})
+]
+
+
+def run_snippet(snippet):
+    output = subprocess.check_output([sys.executable, '-c', snippet])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def measure():
+    return run_snippet(SNIPPET.format(bench_dir=BENCH_DIR))
+
+
+def dispatch(route, query, listing):
+    return run_snippet(DISPATCH_SNIPPET.format(bench_dir=BENCH_DIR, route=route, query=query, listing=listing))
+
+
+def main(runs=5):
+    results = [measure() for _ in range(runs)]
+    import_times = sorted(x['import_ms'] for x in results)
+    median = import_times[len(import_times) // 2]
+    budget = results[0]['budget_ms']
+    print('import: median {0:.1f} ms, min {1:.1f} ms, max {2:.1f} ms (budget {3} ms)'.format(
+        median, import_times[0], import_times[-1], budget))
+    if results[0]['modules']:
+        print('heavy modules imported eagerly: %s' % ', '.join(results[0]['modules']))
+    clients_created = False
+    for route, query, listing in DISPATCH_ROUTES:
+        result = dispatch(route, query, listing)
+        print('{0}{1}: total {2:.1f} ms{3}'.format(route, ' (replayed)' if listing else '', result['total_ms'],
+                                                 ', created the Viaplay client' if result['client_created'] else ''))
+        clients_created = clients_created or result['client_created']
+    return 1 if median > budget or clients_created else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(x) for x in sys.argv[1:2]]))
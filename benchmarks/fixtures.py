@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Viaplay API payloads of realistic shape and size for the benchmarks.
+Recorded payloads can be used instead by saving them as <name>.json in benchmarks/payloads.
+"""
+import os
+import json
+import random
+from datetime import datetime, timedelta
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'payloads')
+IMAGE_TEMPLATE = 'https://i-viaplay-com.akamaized.net/viaplay-prod/{0}/{1}.jpg{{?width,height}}'
+GENRES = ['Drama', 'Komedi', 'Action', 'Thriller', 'Dokumentär', 'Barn', 'Skräck', 'Romantik']
+
+
+def iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def images(index, roles=('landscape', 'hero169', 'coverart23', 'coverart169', 'boxart')):
+    return {role: {'template': IMAGE_TEMPLATE.format(index, role)} for role in roles}
+
+
+def content(index, rnd):
+    return {
+        'title': 'Titel nummer %s' % index,
+        'synopsis': ' '.join(['Lorem ipsum dolor sit amet, åäö ÆØ.'] * rnd.randint(2, 6)),
+        'production': {'year': rnd.randint(1970, 2019), 'country': 'Sverige'},
+        'duration': {'milliseconds': rnd.randint(20, 150) * 60000, 'readable': '1 h 30 min'},
+        'people': {'actors': ['Skådespelare %s' % x for x in range(rnd.randint(2, 8))],
+                   'directors': ['Regissör %s' % index]},
+        'parentalRating': '15',
+        'imdb': {'rating': '%.1f' % rnd.uniform(3, 9), 'votes': str(rnd.randint(100, 90000)),
+                 'id': 'tt%07d' % index},
+        'images': images(index)
+    }
+
+
+def links(index, rnd):
+    return {
+        'self': {'href': 'https://content.viaplay.se/xdk-se/product/%s' % index},
+        'viaplay:page': {'href': 'https://content.viaplay.se/xdk-se/serier/serie-%s' % index},
+        'viaplay:genres': [{'title': x} for x in rnd.sample(GENRES, 3)]
+    }
+
+
+def product(kind, index, now, rnd):
+    """Return a single product of type movie, series, episode, sport or tvEvent."""
+    start = now + timedelta(minutes=rnd.randint(-600, 600))
+    data = {
+        'type': kind,
+        'system': {'guid': 'guid-%s' % index, 'flags': []},
+        '_links': links(index, rnd),
+        'content': content(index, rnd)
+    }
+    if kind == 'series':
+        data['content']['series'] = {'title': 'Serie %s' % index, 'synopsis': 'Om serien', 'seasons': 4}
+    elif kind == 'episode':
+        data['content']['series'] = {'title': 'Serie', 'episodeTitle': 'Avsnitt %s' % index,
+                                     'season': {'seasonNumber': 1 + index // 10}, 'episodeNumber': index % 10 + 1}
+    elif kind == 'sport':
+        data['epg'] = {'start': iso(start), 'end': iso(start + timedelta(hours=2))}
+        data['content']['format'] = {'title': 'Fotboll'}
+    elif kind == 'tvEvent':
+        data['epg'] = {'startTime': iso(start), 'endTime': iso(start + timedelta(hours=1))}
+        data['system']['catchupAvailability'] = {'end': iso(start + timedelta(days=7))}
+    return data
+
+
+def products_page(kind='movie', count=200, seed=1, now=None):
+    """A list page as returned by get_products."""
+    rnd = random.Random(seed)
+    now = now or datetime.utcnow()
+    return {
+        'type': 'list-product',
+        '_links': {'next': {'href': 'https://content.viaplay.se/xdk-se/film/alla?pageNumber=2'}},
+        '_embedded': {'viaplay:products': [product(kind, i, now, rnd) for i in range(count)]}
+    }
+
+
+def channel(index, programs, now, rnd):
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    schedule = []
+    for i in range(programs):
+        length = timedelta(minutes=rnd.choice([15, 30, 45, 60, 90]))
+        schedule.append({
+            'type': 'tvEvent',
+            'system': {'guid': 'program-%s-%s' % (index, i), 'flags': []},
+            'epg': {'start': iso(start), 'end': iso(start + length)},
+            'content': {'title': 'Program %s' % i, 'images': images(i, ('landscape',))}
+        })
+        start += length
+    return {
+        'viaplay:channel': {
+            '_links': {'self': {'href': 'https://content.viaplay.se/xdk-se/kanaler/kanal-%s' % index}},
+            'content': {'title': 'Kanal %s' % index, 'images': images(index, ('logo', 'fallback'))},
+            '_embedded': {'viaplay:products': schedule}
+        }
+    }
+
+
+def channels_page(channels=30, programs=60, seed=2, now=None):
+    """A channels page with a full day EPG for every channel."""
+    rnd = random.Random(seed)
+    now = now or datetime.utcnow()
+    return {
+        'type': 'page',
+        '_links': {},
+        '_embedded': {'viaplay:blocks': [{
+            'type': 'list',
+            '_links': {},
+            '_embedded': {'viaplay:blocks': [channel(i, programs, now, rnd) for i in range(channels)]}
+        }]}
+    }
+
+
+def sport_page(blocks=10, count=40, seed=3, now=None):
+    """A sport page with several blocks of sports events."""
+    rnd = random.Random(seed)
+    now = now or datetime.utcnow()
+    return {
+        'type': 'page',
+        '_links': {},
+        '_embedded': {'viaplay:blocks': [{
+            'type': 'list',
+            'title': 'Block %s' % b,
+            'totalProductCount': count,
+            '_links': {'self': {'href': 'https://content.viaplay.se/xdk-se/sport/block-%s' % b}},
+            '_embedded': {'viaplay:products': [product('sport', b * count + i, now, rnd) for i in range(count)]}
+        } for b in range(blocks)]}
+    }
+
+
+def search_page(count=100, seed=4, now=None):
+    """Mixed search results."""
+    rnd = random.Random(seed)
+    now = now or datetime.utcnow()
+    kinds = ['movie', 'series', 'episode']
+    return {
+        'type': 'list-search',
+        '_links': {},
+        '_embedded': {'viaplay:products': [product(kinds[i % 3], i, now, rnd) for i in range(count)]}
+    }
+
+
+GENERATORS = {
+    'channels': channels_page,
+    'sport': sport_page,
+    'search': search_page,
+    'products': products_page
+}
+
+
+def load(name):
+    """Return a payload as JSON bytes, preferring a recorded one."""
+    path = os.path.join(PAYLOADS_DIR, '%s.json' % name)
+    if os.path.exists(path):
+        with open(path, 'rb') as payload:
+            return payload.read()
+    return json.dumps(GENERATORS[name]()).encode('utf-8')
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks for the parsing and listing hot paths.
+Usage:
+    python benchmarks/hotpaths.py [-o results.json] [-r repeats]
+    python benchmarks/hotpaths.py --compare old.json new.json
+"""
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import tracemalloc
+from collections import OrderedDict
+
+import fixtures
+import kodistubs
+
+cli_args = sys.argv[1:]  # install() replaces sys.argv with the plugin arguments
+kodistubs.install()
+
+from resources.lib import addon  # noqa: E402
+from resources.lib.epg import EpgIndex  # noqa: E402
+
+RESULT_FORMAT = 1
+
+
+class MissingEpgStore(object):
+    """An EPG store that never has a page, so the channel benchmarks always parse the served payload."""
+
+    def get_page(self, url, now):
+        return None
+
+    def store_page(self, url, channels_dict, now):
+        pass
+
+    def clear(self):
+        pass
+
+
+def payload(name, **kwargs):
+    return json.loads(json.dumps(fixtures.GENERATORS[name](**kwargs)))
+
+
+def make_benchmarks():
+    """Return the benchmarks by name. Every benchmark is a function without arguments."""
+    vp = addon.helper.vp
+    vp.epg_store = MissingEpgStore()
+    movies = payload('products', kind='movie')
+    series = payload('products', kind='series')
+    episodes = payload('products', kind='episode')
+    tv_events = payload('products', kind='tvEvent')
+    sport = payload('sport')
+    channels = payload('channels')
+    channels_json = json.dumps(channels)
+    programs = [p for c in channels['_embedded']['viaplay:blocks'][0]['_embedded']['viaplay:blocks']
+                for p in c['viaplay:channel']['_embedded']['viaplay:products']]
+    sport_events = [p for b in sport['_embedded']['viaplay:blocks'] for p in b['_embedded']['viaplay:products']]
+    timestamps = [p['epg']['start'] for p in programs]
+
+    def served(data):
+        """Return a Viaplay.make_request replacement returning data."""
+        return lambda *args, **kwargs: data
+
+    def get_products():
+        vp.make_request = served(movies)
+        vp.get_products('https://content.viaplay.se/xdk-se/film')
+
+    def get_channels():
+        vp.make_request = served(channels)
+        vp.get_channels('https://content.viaplay.se/xdk-se/kanaler')
+
+    def channels_route():
+        vp.make_request = served(json.loads(channels_json))  # get_channels adds the EPG index to the channels
+        addon.plugin.args = {'url': ['https://content.viaplay.se/xdk-se/kanaler']}
+        addon.channels()
+
+    def list_products():
+        vp.make_request = served(movies)
+        addon.list_products('https://content.viaplay.se/xdk-se/film')
+
+    def mapper(func, products):
+        products = vp.normalize_products(products)
+
+        def map_products():
+            for product in products:
+                func(product)
+            addon.helper.items = []  # the listing is never handed to Kodi
+        return map_products
+
+    return OrderedDict([
+        ('viaplay.get_products', get_products),
+        ('viaplay.get_channels', get_channels),
+        ('viaplay.get_event_status', lambda: [vp.get_event_status(x) for x in programs]),
+        ('viaplay.parse_datetime', lambda: [vp.parse_datetime(x, localize=True) for x in timestamps]),
+        ('addon.list_products', list_products),
+        ('addon.channels', channels_route),
+        ('epg.EpgIndex', lambda: [EpgIndex(c['viaplay:channel']['_embedded']['viaplay:products'])
+                                  for c in channels['_embedded']['viaplay:blocks'][0]['_embedded']['viaplay:blocks']]),
+        ('addon.add_movie', mapper(addon.add_movie, movies['_embedded']['viaplay:products'])),
+        ('addon.add_series', mapper(addon.add_series, series['_embedded']['viaplay:products'])),
+        ('addon.add_episode', mapper(addon.add_episode, episodes['_embedded']['viaplay:products'])),
+        ('addon.add_sports_event', mapper(addon.add_sports_event, sport_events)),
+        ('addon.add_tv_event', mapper(addon.add_tv_event, tv_events['_embedded']['viaplay:products'])),
+        ('viaplay.normalize_products', lambda: vp.normalize_products(sport_events)),
+        ('viaplay.get_art', lambda: [vp.get_art(x['content']['images'], 'movie')
+                                     for x in movies['_embedded']['viaplay:products']])
+    ])
+
+
+def measure(func, repeats):
+    """Return timing and allocation stats for func."""
+    func()  # warm up
+    timings = timeit.repeat(func, number=1, repeat=repeats)
+    tracemalloc.start()
+    func()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return OrderedDict([
+        ('best_ms', round(min(timings) * 1000, 3)),
+        ('mean_ms', round(sum(timings) / len(timings) * 1000, 3)),
+        ('peak_kib', round(peak / 1024.0, 1)),
+        ('retained_kib', round(size / 1024.0, 1))
+    ])
+
+
+def run(repeats):
+    results = OrderedDict()
+    for name, func in make_benchmarks().items():
+        results[name] = measure(func, repeats)
+        print('{0:<26} {1[best_ms]:9.3f} ms  {1[peak_kib]:9.1f} KiB peak'.format(name, results[name]))
+    return OrderedDict([
+        ('format', RESULT_FORMAT),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('machine', platform.machine()),
+        ('repeats', repeats),
+        ('results', results)
+    ])
+
+
+def compare(old_file, new_file):
+    with open(old_file) as old, open(new_file) as new:
+        old_results = json.load(old)['results']
+        new_results = json.load(new)['results']
+    for name, new_stats in new_results.items():
+        if name not in old_results:
+            continue
+        old_stats = old_results[name]
+        print('{0:<26} {1:9.3f} -> {2:9.3f} ms ({3:+.1f}%)  {4:9.1f} -> {5:9.1f} KiB peak'.format(
+            name, old_stats['best_ms'], new_stats['best_ms'],
+            (new_stats['best_ms'] / old_stats['best_ms'] - 1) * 100, old_stats['peak_kib'], new_stats['peak_kib']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('-r', '--repeats', type=int, default=10)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args(cli_args)
+    if args.compare:
+        return compare(*args.compare)
+    results = run(args.repeats)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
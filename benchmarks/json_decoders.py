@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the JSON decoders parse_response can use on channel, sport and search payloads.
+Usage: python benchmarks/json_decoders.py [repeats]
+"""
+import sys
+import json
+import timeit
+from collections import OrderedDict
+
+import fixtures
+
+
+def decoders():
+    """Return the available decoders by name."""
+    available = OrderedDict([
+        ('json+OrderedDict', lambda x: json.loads(x, object_pairs_hook=OrderedDict)),
+        ('json', json.loads)
+    ])
+    try:
+        import orjson
+        available['orjson'] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        available['ujson'] = ujson.loads
+    except ImportError:
+        pass
+    return available
+
+
+def main(repeats=20):
+    for name in ('channels', 'sport', 'search'):
+        payload = fixtures.load(name)
+        print('{0} ({1} KiB)'.format(name, len(payload) // 1024))
+        baseline = None
+        for decoder_name, decoder in decoders().items():
+            best = min(timeit.repeat(lambda: decoder(payload), number=1, repeat=repeats))
+            baseline = baseline or best
+            print('  {0:<18} {1:8.2f} ms  {2:5.2f}x'.format(decoder_name, best * 1000, baseline / best))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
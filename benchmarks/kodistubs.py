@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal stand-ins for the Kodi Python modules so the add-on can be imported outside Kodi.
+"""
+import os
+import sys
+import types
+import tempfile
+from urllib.parse import urlsplit, parse_qs
+
+PROFILE_DIR = tempfile.mkdtemp(prefix='viaplay-bench-')
+
+
+class ListItem(object):
+    def __init__(self, label='', path=None):
+        self.label = label
+        self.path = path
+        self.properties = {}
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def setArt(self, art):
+        self.art = art
+
+    def setInfo(self, info_type, info):
+        self.info = info
+
+    def setContentLookup(self, enable):
+        pass
+
+    def setMimeType(self, mimetype):
+        pass
+
+    def setSubtitles(self, paths):
+        self.subtitles = paths
+
+
+class Dialog(object):
+    """Answers every dialog as if it was cancelled."""
+
+    def ok(self, heading, message):
+        return True
+
+    def yesno(self, heading, message, nolabel=None, yeslabel=None):
+        return False
+
+    def select(self, heading, options):
+        return -1
+
+    def notification(self, heading, message, icon=None, time=5000):
+        pass
+
+
+class Addon(object):
+    settings = {'site': '0', 'first_run': 'false'}
+
+    def __init__(self, addon_id=None):
+        pass
+
+    def getAddonInfo(self, key):
+        if key in ('path', 'profile'):
+            return PROFILE_DIR
+        return 'plugin.video.viaplay' if key == 'id' else key
+
+    def getSetting(self, key):
+        return self.settings.get(key, '')
+
+    def setSetting(self, key, value):
+        self.settings[key] = value
+
+    def getLocalizedString(self, string_id):
+        return 'String %s {0}' % string_id
+
+    def openSettings(self):
+        pass
+
+
+class Plugin(object):
+    """Stand-in for script.module.routing."""
+
+    def __init__(self):
+        self.args = {}
+        self.routes = {}
+
+    def route(self, path):
+        def decorator(func):
+            func.route_path = path
+            self.routes[path] = func
+            return func
+        return decorator
+
+    def url_for(self, func, **kwargs):
+        return 'plugin://plugin.video.viaplay%s?%s' % (
+            func.route_path, '&'.join('%s=%s' % (k, v) for k, v in sorted(kwargs.items())))
+
+    def run(self, argv=None):
+        """Call the route of the plugin URL in argv, sys.argv by default."""
+        argv = argv or sys.argv
+        self.args = parse_qs(argv[2].lstrip('?')) if len(argv) > 2 else {}
+        func = self.routes.get(urlsplit(argv[0]).path or '/')
+        if func:
+            func()
+
+
+def module(name, **attributes):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attributes)
+    sys.modules[name] = mod
+    return mod
+
+
+def install():
+    """Register the stub modules and the plugin arguments the add-on expects."""
+    noop = lambda *args, **kwargs: None
+    module('xbmc', log=noop, LOGDEBUG=0, LOGINFO=1, LOGWARNING=2, getCondVisibility=lambda x: False, sleep=noop,
+           executebuiltin=noop, Monitor=object, Keyboard=object)
+    module('xbmcvfs', translatePath=lambda x: x, exists=os.path.exists, mkdir=os.makedirs)
+    module('xbmcgui', ListItem=ListItem, Dialog=Dialog, DialogProgress=object, getCurrentWindowId=lambda: 0)
+    module('xbmcplugin', addDirectoryItem=noop, addDirectoryItems=noop, setContent=noop, endOfDirectory=noop,
+           setResolvedUrl=noop, addSortMethod=noop, SORT_METHOD_UNSORTED=0, SORT_METHOD_LABEL_IGNORE_THE=1,
+           SORT_METHOD_VIDEO_YEAR=2)
+    module('xbmcaddon', Addon=Addon)
+    module('inputstreamhelper', Helper=object)
+    module('routing', Plugin=Plugin)
+    sys.argv = ['plugin://plugin.video.viaplay/', '1', '']
+    addon_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if addon_root not in sys.path:
+        sys.path.insert(0, addon_root)
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
-from resources.lib import addon
+import time
+started = time.time()
+
+from resources.lib import addon  # noqa: E402
 
 if __name__ == '__main__':
-    addon.run()
+    addon.run(started)
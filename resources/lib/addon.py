@@ -2,10 +2,14 @@
 """
 A Kodi add-on for Viaplay
 """
+import os
 import sys
-from datetime import datetime
+import time
+import functools
+from urllib.parse import urlsplit, parse_qs
 
 from resources.lib.kodihelper import KodiHelper
+from resources.lib.viaplay import Viaplay
 
 import xbmc
 import xbmcgui
@@ -15,20 +19,66 @@ base_url = sys.argv[0]
 handle = int(sys.argv[1])
 helper = KodiHelper(base_url, handle)
 plugin = routing.Plugin()
+plugin_args = parse_qs(sys.argv[2].lstrip('?')) if len(sys.argv) > 2 else {}
 
-
-def run():
-    try:
-        plugin.run()
-    except helper.vp.ViaplayError as error:
-        if error.value == b'MissingSessionCookieError':
-            if helper.authorize():
-                plugin.run()
-        else:
-            show_error(error.value)
+COLD_START_BUDGET = 150  # milliseconds from default.py starting until the route is dispatched
 
 
-@plugin.route('/')
+def run(started=None):
+    """Dispatch the route. started is the time the interpreter started loading the add-on."""
+    imported = time.time()
+    profiler = None
+    if helper.get_setting('profile_routes'):
+        from resources.lib.profiling import RouteProfiler  # deferred, only needed when profiling
+        profiler = RouteProfiler(os.path.join(helper.addon_profile, 'route_profile.jsonl'),
+                                 helper.addon_profile if helper.get_setting('profile_routes_cprofile') else None)
+        profiler.start()
+    try:
+        if 'url' in plugin_args and helper.get_setting('prefetch'):
+            helper.prefetcher.record_visit(plugin_args['url'][0])
+        try:
+            plugin.run()
+        except Viaplay.ViaplayError as error:
+            if error.value == b'MissingSessionCookieError':
+                if helper.authorize():
+                    plugin.run()
+            else:
+                show_error(error.value)
+    finally:
+        if profiler:
+            summary = profiler.stop(urlsplit(base_url).path, *helper.request_stats())
+            helper.log('Route profile of {route}: wall {wall}s, cpu {cpu}s, peak {peak_kib} KiB, '
+                       '{requests} requests, {bytes} bytes'.format(**summary))
+    if started and helper.get_setting('cold_start_report'):
+        report_cold_start(started, imported)
+
+
+def report_cold_start(started, imported):
+    """Log how long the add-on took to import and to run, and warn when the budget is exceeded."""
+    import_time = (imported - started) * 1000
+    total_time = (time.time() - started) * 1000
+    message = 'Cold start of {0}: import {1:.0f} ms, total {2:.0f} ms (import budget {3} ms)'.format(
+        urlsplit(base_url).path, import_time, total_time, COLD_START_BUDGET)
+    xbmc.log('%s: %s' % (helper.logging_prefix, message),
+             level=xbmc.LOGWARNING if import_time > COLD_START_BUDGET else xbmc.LOGINFO)
+
+
+def stored_listing(max_age):
+    """Render the route from the listing stored on an earlier visit while it's younger than max_age seconds.
+    max_age may be a function of the route's url argument. Direct calls from other routes are not stored."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not args and not kwargs:
+                age = max_age(plugin.args['url'][0]) if callable(max_age) else max_age
+                if helper.replay_listing(base_url + (sys.argv[2] if len(sys.argv) > 2 else ''), age):
+                    return None
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@plugin.route('/')  # not stored, the root page is where an expired session is noticed
 def root():
     pages = helper.vp.get_root_page()
     supported_pages = {
@@ -58,38 +108,52 @@ def root():
 
 
 @plugin.route('/start')
+@stored_listing(600)
 def start():
     collections = helper.vp.get_collections(plugin.args['url'][0])
-    for i in collections:
+    for index, i in enumerate(collections):
         if i['type'] == 'list-featurebox':  # skip feature box for now
             continue
         helper.add_item(i['title'], plugin.url_for(list_products, url=i['_links']['self']['href']))
+        if index < 3:
+            prefetch_products(i['_links']['self']['href'], 3 - index)
     helper.eod()
 
 
 @plugin.route('/search')
 def search():
     query = helper.get_user_input(helper.language(30015))
-    if query:
+    if not query:
+        return
+    products = helper.vp.search_local(query) if helper.get_setting('local_search') else []
+    if products:  # show the local matches right away and let the user ask Viaplay for more
+        add_products(products)
+        helper.add_item(helper.language(30058), plugin.url_for(list_products, url=plugin.args['url'][0], query=query))
+        helper.eod()
+    else:
         list_products(plugin.args['url'][0], search_query=query)
 
 
 @plugin.route('/vod')
+@stored_listing(3600)
 def vod():
     """List categories and collections from the VOD pages (movies, series, kids, store)."""
     helper.add_item(helper.language(30041), plugin.url_for(categories, url=plugin.args['url'][0]))
     collections = helper.vp.get_collections(plugin.args['url'][0])
-    for i in collections:
+    for index, i in enumerate(collections):
         helper.add_item(i['title'], plugin.url_for(list_products, url=i['_links']['self']['href']))
+        if index < 3:
+            prefetch_products(i['_links']['self']['href'], 3 - index)
     helper.eod()
 
 
 @plugin.route('/sport')
+@stored_listing(120)
 def sport():
     collections = helper.vp.get_collections(plugin.args['url'][0])
     schedule_added = False
 
-    for i in collections:
+    for index, i in enumerate(collections):
         if 'viaplay:seeTableau' in i['_links'] and not schedule_added:
             plugin_url = plugin.url_for(sports_schedule, url=i['_links']['viaplay:seeTableau']['href'])
             helper.add_item(i['_links']['viaplay:seeTableau']['title'], plugin_url)
@@ -98,39 +162,33 @@ def sport():
         if i['totalProductCount'] < 1:
             continue  # hide empty collections
         helper.add_item(i['title'], plugin.url_for(list_products, url=i['_links']['self']['href']))
+        if index < 3:
+            prefetch_products(i['_links']['self']['href'], 3 - index)
     helper.eod()
 
 
 @plugin.route('/channels')
+@stored_listing(60)
 def channels():
     channels_dict = helper.vp.get_channels(plugin.args['url'][0])
+    now = time.time()
 
     for channel in channels_dict['channels']:
         plugin_url = plugin.url_for(list_products, url=channel['_links']['self']['href'])
-        if 'fallback' in channel['content']['images']:
-            channel_image = channel['content']['images']['fallback']['template'].split('{')[0]
-        else:
-            channel_image = channel['content']['images']['logo']['template'].split('{')[0]
-        art = {
-            'thumb': channel_image,
-            'fanart': channel_image
-        }
-
-        for program in channel['_embedded']['viaplay:products']:  # get current live program
-            if helper.vp.get_event_status(program) == 'live':
-                if 'content' in program:
-                    current_program_title = coloring(program['content']['title'], 'live')
-                else:  # no broadcast
-                    current_program_title = coloring(helper.language(30049), 'no_broadcast')
-                break
+        program = channel['epg_index'].now(now)  # get current live program
+        if program and 'content' in program:
+            current_program_title = coloring(program['content']['title'], 'live')
+        else:  # no broadcast
+            current_program_title = coloring(helper.language(30049), 'no_broadcast')
 
         list_title = '[B]{0}[/B]: {1}'.format(channel['content']['title'], current_program_title)
 
-        helper.add_item(list_title, plugin_url, art=art)
+        helper.add_item(list_title, plugin_url, art=channel['art'])
 
     if channels_dict['next_page']:
         helper.add_item(helper.language(30018), plugin.url_for(channels, url=channels_dict['next_page']))
-    helper.eod()
+        helper.prefetch(channels_dict['next_page'], 5)
+    helper.eod(cache_to_disc=False)  # the live programs change all the time
 
 
 @plugin.route('/log_out')
@@ -139,28 +197,53 @@ def log_out():
 
 
 @plugin.route('/list_products')
+@stored_listing(Viaplay.get_cache_ttl)  # personal lists are never stored
 def list_products(url=None, search_query=None):
     if not url:
         url = plugin.args['url'][0]
-    products_dict = helper.vp.get_products(url, search_query=search_query)
-    for product in products_dict['products']:
-        if product['type'] == 'series':
+    if not search_query and 'query' in plugin.args:
+        search_query = plugin.args['query'][0]
+    min_items = products_per_listing()
+    products_dict = helper.vp.get_product_listing(url, min_items, search_query=search_query,
+                                                  page_size=min_items or None)
+    if not add_products(products_dict['products']):
+        return False
+
+    if products_dict['next_page']:
+        helper.add_item(helper.language(30018), plugin.url_for(list_products, url=products_dict['next_page']))
+        prefetch_products(products_dict['next_page'], 5)
+    helper.eod()
+
+
+def products_per_listing():
+    """Return the number of products a listing should have at least, 0 for one page."""
+    return int(helper.get_setting('items_per_listing') or 0)
+
+
+def prefetch_products(url, weight):
+    """Queue a product page with the page size list_products will ask for, so it's the page that gets cached."""
+    page_size = products_per_listing()
+    helper.prefetch(Viaplay.set_page_size(url, page_size) if page_size else url, weight)
+
+
+def add_products(products):
+    """Add list items for the products. Return False if a product type isn't supported."""
+    for product in products:
+        if product.type == 'series':
             add_series(product)
-        elif product['type'] == 'episode':
+        elif product.type == 'episode':
             add_episode(product)
-        elif product['type'] == 'movie':
+        elif product.type == 'movie':
             add_movie(product)
-        elif product['type'] == 'sport':
+        elif product.type == 'sport':
             add_sports_event(product)
-        elif product['type'] == 'tvEvent':
+        elif product.type == 'tvEvent':
             add_tv_event(product)
         else:
-            helper.log('product type: {0} is not (yet) supported.'.format(product['type']))
+            helper.log('product type: {0} is not (yet) supported.'.format(product.type))
             return False
 
-    if products_dict['next_page']:
-        helper.add_item(helper.language(30018), plugin.url_for(list_products, url=products_dict['next_page']))
-    helper.eod()
+    return True
 
 
 @plugin.route('/sports_schedule')
@@ -172,19 +255,32 @@ def sports_schedule():
 
 
 @plugin.route('/seasons_page')
+@stored_listing(600)
 def seasons_page():
     """List all series seasons."""
     seasons = helper.vp.get_seasons(plugin.args['url'][0])
     if len(seasons) == 1:  # list products if there's only one season
         list_products(seasons[0]['_links']['self']['href'])
     else:
+        if len(seasons) > 1:  # an empty series gets no 'All episodes' item
+            helper.add_item(helper.language(30060), plugin.url_for(all_episodes, url=plugin.args['url'][0]))
         for season in seasons:
             title = helper.language(30014).format(season['title'])
             helper.add_item(title, plugin.url_for(list_products, url=season['_links']['self']['href']))
         helper.eod()
 
 
+@plugin.route('/all_episodes')
+@stored_listing(600)
+def all_episodes():
+    """List the episodes of all seasons in one listing."""
+    seasons = helper.vp.get_seasons(plugin.args['url'][0])
+    add_products(helper.vp.get_all_episodes([x['_links']['self']['href'] for x in seasons]))
+    helper.eod()
+
+
 @plugin.route('/categories')
+@stored_listing(3600)
 def categories():
     categories_data = helper.vp.make_request(plugin.args['url'][0], 'get')['_links']['viaplay:categoryFilters']
     for i in categories_data:
@@ -193,6 +289,7 @@ def categories():
 
 
 @plugin.route('/sortings')
+@stored_listing(3600)
 def sortings():
     sortings_data = helper.vp.make_request(plugin.args['url'][0], 'get')['_links']['viaplay:sortings']
     for i in sortings_data:
@@ -218,100 +315,85 @@ def ia_settings():
 
 
 def add_movie(movie):
-    if movie['system'].get('guid'):
-        guid = movie['system']['guid']
+    if movie.guid:
+        guid = movie.guid
         url = None
     else:
         guid = None
-        url = movie['_links']['self']['href']
+        url = movie.url
 
     plugin_url = plugin.url_for(play, guid=guid, url=url, tve='false')
-    details = movie['content']
-
     movie_info = {
         'mediatype': 'movie',
-        'title': details['title'],
-        'plot': details.get('synopsis'),
-        'genre': ', '.join([x['title'] for x in movie['_links']['viaplay:genres']]),
-        'year': details['production'].get('year'),
-        'duration': int(details['duration'].get('milliseconds')) // 1000 if 'duration' in details else None,
-        'cast': details['people'].get('actors', []) if 'people' in details else [],
-        'director': ', '.join(details['people'].get('directors', [])) if 'people' in details else [],
-        'mpaa': details.get('parentalRating'),
-        'rating': float(details['imdb'].get('rating')) if 'imdb' in details else None,
-        'votes': str(details['imdb'].get('votes')) if 'imdb' in details else None,
-        'code': details['imdb'].get('id') if 'imdb' in details else None
+        'title': movie.title,
+        'plot': movie.plot,
+        'genre': movie.genre,
+        'year': movie.year,
+        'duration': movie.duration,
+        'cast': movie.cast,
+        'director': movie.director,
+        'mpaa': movie.mpaa,
+        'rating': movie.rating,
+        'votes': movie.votes,
+        'code': movie.code
     }
 
-    helper.add_item(movie_info['title'], plugin_url, info=movie_info, art=add_art(details['images'], 'movie'),
-                    content='movies', playable=True)
+    helper.add_item(movie.title, plugin_url, info=movie_info, art=movie.art, content='movies', playable=True)
 
 
 def add_series(show):
-    plugin_url = plugin.url_for(seasons_page, url=show['_links']['viaplay:page']['href'])
-    details = show['content']
+    plugin_url = plugin.url_for(seasons_page, url=show.page_url)
+    helper.prefetch(show.page_url)
 
     series_info = {
         'mediatype': 'tvshow',
-        'title': details['series']['title'],
-        'tvshowtitle': details['series']['title'],
-        'plot': details['synopsis'] if details.get('synopsis') else details['series'].get('synopsis'),
-        'genre': ', '.join([x['title'] for x in show['_links']['viaplay:genres']]),
-        'year': details['production'].get('year') if 'production' in details else None,
-        'cast': details['people'].get('actors', []) if 'people' in details else [],
-        'director': ', '.join(details['people'].get('directors', [])) if 'people' in details else None,
-        'mpaa': details.get('parentalRating'),
-        'rating': float(details['imdb'].get('rating')) if 'imdb' in details else None,
-        'votes': str(details['imdb'].get('votes')) if 'imdb' in details else None,
-        'code': details['imdb'].get('id') if 'imdb' in details else None,
-        'season': int(details['series']['seasons']) if details['series'].get('seasons') else None
+        'title': show.series_title,
+        'tvshowtitle': show.series_title,
+        'plot': show.plot,
+        'genre': show.genre,
+        'year': show.year,
+        'cast': show.cast,
+        'director': show.director,
+        'mpaa': show.mpaa,
+        'rating': show.rating,
+        'votes': show.votes,
+        'code': show.code,
+        'season': show.seasons
     }
 
-    helper.add_item(series_info['title'], plugin_url, folder=True, info=series_info,
-                    art=add_art(details['images'], 'series'), content='tvshows')
+    helper.add_item(show.series_title, plugin_url, folder=True, info=series_info, art=show.art, content='tvshows')
 
 
 def add_episode(episode):
-    plugin_url = plugin.url_for(play, guid=episode['system']['guid'], url=None, tve='false')
-    details = episode['content']
+    plugin_url = plugin.url_for(play, guid=episode.guid, url=None, tve='false')
 
     episode_info = {
         'mediatype': 'episode',
-        'title': details.get('title'),
-        'list_title': details['series']['episodeTitle'] if details['series'].get('episodeTitle') else details.get(
-            'title'),
-        'tvshowtitle': details['series'].get('title'),
-        'plot': details['synopsis'] if details.get('synopsis') else details['series'].get('synopsis'),
-        'duration': details['duration']['milliseconds'] // 1000 if 'duration' in details else None,
-        'genre': ', '.join([x['title'] for x in episode['_links']['viaplay:genres']]),
-        'year': details['production'].get('year') if 'production' in details else None,
-        'cast': details['people'].get('actors', []) if 'people' in details else [],
-        'director': ', '.join(details['people'].get('directors', [])) if 'people' in details else None,
-        'mpaa': details.get('parentalRating'),
-        'rating': float(details['imdb'].get('rating')) if 'imdb' in details else None,
-        'votes': str(details['imdb'].get('votes')) if 'imdb' in details else None,
-        'code': details['imdb'].get('id') if 'imdb' in details else None,
-        'season': int(details['series']['season'].get('seasonNumber')),
-        'episode': int(details['series'].get('episodeNumber'))
+        'title': episode.title,
+        'tvshowtitle': episode.series_title,
+        'plot': episode.plot,
+        'duration': episode.duration,
+        'genre': episode.genre,
+        'year': episode.year,
+        'cast': episode.cast,
+        'director': episode.director,
+        'mpaa': episode.mpaa,
+        'rating': episode.rating,
+        'votes': episode.votes,
+        'code': episode.code,
+        'season': episode.season,
+        'episode': episode.episode
     }
 
-    helper.add_item(episode_info['list_title'], plugin_url, info=episode_info,
-                    art=add_art(details['images'], 'episode'), content='episodes', playable=True)
+    helper.add_item(episode.episode_title or episode.title, plugin_url, info=episode_info, art=episode.art,
+                    content='episodes', playable=True)
 
 
 def add_sports_event(event):
-    now = datetime.now()
-    date_today = now.date()
-    event_date = helper.vp.parse_datetime(event['epg']['start'], localize=True)
-    event_status = helper.vp.get_event_status(event)
+    start_time = event_start_time(event)
 
-    if date_today == event_date.date():
-        start_time = '{0} {1}'.format(helper.language(30027), event_date.strftime('%H:%M'))
-    else:
-        start_time = event_date.strftime('%Y-%m-%d %H:%M')
-
-    if event_status != 'upcoming':
-        plugin_url = plugin.url_for(play, guid=event['system']['guid'] + '-%s' % helper.get_country_code().upper(), url=None, tve='false')
+    if event.status != 'upcoming':
+        plugin_url = plugin.url_for(play, guid=event.guid + '-%s' % helper.get_country_code().upper(), url=None, tve='false')
         playable = True
     else:
         plugin_url = plugin.url_for(dialog, dialog_type='ok',
@@ -319,36 +401,25 @@ def add_sports_event(event):
                              message=helper.language(30016).format(start_time))
         playable = False
 
-    details = event['content']
     event_info = {
         'mediatype': 'video',
-        'title': details.get('title'),
-        'plot': details['synopsis'],
-        'year': int(details['production'].get('year')),
-        'genre': details['format'].get('title'),
-        'list_title': '[B]{0}:[/B] {1}'.format(coloring(start_time, event_status), details.get('title'))
+        'title': event.title,
+        'plot': event.plot,
+        'year': int(event.year) if event.year else None,
+        'genre': event.format
     }
+    list_title = '[B]{0}:[/B] {1}'.format(coloring(start_time, event.status), event.title)
 
-    helper.add_item(event_info['list_title'], plugin_url, playable=playable, info=event_info,
-                    art=add_art(details['images'], 'sport'), content='episodes')
+    helper.add_item(list_title, plugin_url, playable=playable, info=event_info, art=event.art, content='episodes')
 
 
 def add_tv_event(event):
-    now = datetime.now()
-    date_today = now.date()
-    start_time_obj = helper.vp.parse_datetime(event['epg']['startTime'], localize=True)
-    event_status = helper.vp.get_event_status(event)
-
-    # hide non-available catchup items
-    if now > helper.vp.parse_datetime(event['system']['catchupAvailability']['end'], localize=True):
+    if event.expired:  # hide non-available catchup items
         return
-    if date_today == start_time_obj.date():
-        start_time = '{0} {1}'.format(helper.language(30027), start_time_obj.strftime('%H:%M'))
-    else:
-        start_time = start_time_obj.strftime('%Y-%m-%d %H:%M')
+    start_time = event_start_time(event)
 
-    if event_status != 'upcoming':
-        plugin_url = plugin.url_for(play, guid=event['system']['guid'] + '-%s' % helper.get_country_code().upper(), url=None, tve='true')
+    if event.status != 'upcoming':
+        plugin_url = plugin.url_for(play, guid=event.guid + '-%s' % helper.get_country_code().upper(), url=None, tve='true')
         playable = True
     else:
         plugin_url = plugin.url_for(dialog, dialog_type='ok',
@@ -356,44 +427,23 @@ def add_tv_event(event):
                              message=helper.language(30016).format(start_time))
         playable = False
 
-    details = event['content']
     event_info = {
         'mediatype': 'video',
-        'title': details.get('title'),
-        'plot': details.get('synopsis'),
-        'year': details['production'].get('year'),
-        'list_title': '[B]{0}:[/B] {1}'.format(coloring(start_time, event_status), details.get('title'))
-    }
-    art = {
-        'thumb': event['content']['images']['landscape']['template'].split('{')[0] if 'landscape' in details['images'] else None,
-        'fanart': event['content']['images']['landscape']['template'].split('{')[0] if 'landscape' in details['images'] else None
+        'title': event.title,
+        'plot': event.plot,
+        'year': event.year
     }
+    list_title = '[B]{0}:[/B] {1}'.format(coloring(start_time, event.status), event.title)
 
-    helper.add_item(event_info['list_title'], plugin_url, playable=playable, info=event_info, art=art, content='episodes')
+    helper.add_item(list_title, plugin_url, playable=playable, info=event_info, art=event.art, content='episodes')
 
 
-def add_art(images, content_type):
-    artwork = {}
-
-    for i in images:
-        image_url = images[i]['template'].split('{')[0]  # get rid of template
-
-        if i == 'landscape':
-            if content_type == 'episode' or 'sport':
-                artwork['thumb'] = image_url
-            artwork['banner'] = image_url
-        elif i == 'hero169':
-            artwork['fanart'] = image_url
-        elif i == 'coverart23':
-            if content_type != 'sport':
-                artwork['poster'] = image_url
-        elif i == 'coverart169':
-            artwork['cover'] = image_url
-        elif i == 'boxart':
-            if content_type != 'episode' or content_type != 'sport':
-                artwork['thumb'] = image_url
-
-    return artwork
+def event_start_time(event):
+    """Return the local start time of an event, with 'Today' instead of the date for today's events."""
+    if event.is_today:
+        return '{0} {1}'.format(helper.language(30027), event.start_local.strftime('%H:%M'))
+    else:
+        return event.start_local.strftime('%Y-%m-%d %H:%M')
 
 
 def coloring(text, meaning):
@@ -419,6 +469,8 @@ def show_error(error):
         message = helper.language(30022)
     elif error == b'ConcurrentStreamsLimitReachedError':
         message = helper.language(30050)
+    elif error == b'ServiceUnavailableError':
+        message = helper.language(30062)
     else:
         message = error
 
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Artwork URLs sized for the way Kodi shows them
+"""
+import re
+
+# image width per Kodi artwork role for each quality profile, None keeps the original images
+PROFILES = {
+    'original': None,
+    'high': {'thumb': 640, 'poster': 500, 'fanart': 1920, 'banner': 1280, 'cover': 1280, 'logo': 400},
+    'medium': {'thumb': 480, 'poster': 342, 'fanart': 1280, 'banner': 960, 'cover': 960, 'logo': 300},
+    'low': {'thumb': 320, 'poster': 250, 'fanart': 960, 'banner': 640, 'cover': 640, 'logo': 200}
+}
+QUALITY_PROFILES = ('original', 'high', 'medium', 'low')  # in the order of the artwork_quality setting
+# width / height of the Viaplay image types, logos come in any shape
+ASPECTS = {
+    'landscape': 16 / 9.0,
+    'hero169': 16 / 9.0,
+    'coverart169': 16 / 9.0,
+    'coverart23': 2 / 3.0,
+    'boxart': 2 / 3.0
+}
+TEMPLATE_PATTERN = re.compile(r'\{([?&]?)([^}]*)\}')
+
+
+def expand(template, values):
+    """Fill in the {name}, {?name,...} and {&name,...} expressions of a URI template.
+    Variables without a value are left out, like RFC 6570 does."""
+    def replace(match):
+        operator, names = match.groups()
+        pairs = [(x, values[x]) for x in names.split(',') if values.get(x) is not None]
+        if not pairs:
+            return ''
+        if operator:
+            return operator + '&'.join('{0}={1}'.format(name, value) for name, value in pairs)
+        return ','.join(str(value) for _, value in pairs)
+
+    return TEMPLATE_PATTERN.sub(replace, template)
+
+
+class ArtworkResolver(object):
+    """Turns Viaplay image templates into URLs of images sized for a Kodi artwork role."""
+
+    def __init__(self, quality='high'):
+        self.widths = PROFILES.get(quality, PROFILES['high'])
+        self.expanded = {}  # the templates end with the same few expressions
+
+    def resolve(self, template, role, image_type=None):
+        """Return the image URL of template for role, a Kodi artwork role or 'logo'."""
+        url, _, expression = template.partition('{')
+        if not self.widths or role not in self.widths:
+            return url  # the original image
+        key = (expression, role, image_type)
+        if key not in self.expanded:
+            width = self.widths[role]
+            aspect = ASPECTS.get(image_type)
+            values = {'width': width, 'height': int(round(width / aspect)) if aspect else None}
+            self.expanded[key] = expand('{' + expression, values) if expression else ''
+        return url + self.expanded[key]
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+A persistent HTTP response cache for the Viaplay library
+"""
+import sqlite3
+import time
+from urllib.parse import urlencode
+
+from .sqlitestore import SqliteStore
+
+
+class HttpCache(SqliteStore):
+    """SQLite backed response cache."""
+    schema = (
+        'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, '
+        'expires REAL, accessed REAL, size INTEGER)',
+        'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)'
+    )
+
+    def __init__(self, db_path, max_size=20 * 1024 * 1024):
+        SqliteStore.__init__(self, db_path)
+        self.max_size = max_size
+
+    @staticmethod
+    def make_key(url, params=None):
+        """Return the cache key for an (already parsed) URL and its query parameters."""
+        if params:
+            return '{0}?{1}'.format(url, urlencode(sorted(params.items())))
+        return url
+
+    def get(self, key, body=True):
+        """Return the cached entry as a dict or None if the key isn't cached.
+        Without body, the body is left in the database to be read with iter_body."""
+        try:
+            row = self.conn.execute('SELECT etag, last_modified, expires, size{0} FROM responses WHERE key = ?'.format(
+                ', body' if body else ''), (key,)).fetchone()
+            if not row:
+                return None
+            self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.Error:
+            return None
+
+        entry = {
+            'etag': row[0],
+            'last_modified': row[1],
+            'expires': row[2],
+            'size': row[3]
+        }
+        if body:
+            entry['body'] = bytes(row[4])
+        return entry
+
+    def iter_body(self, key, chunk_size=64 * 1024):
+        """Yield the cached body of key in chunks, without reading all of it into memory where sqlite allows."""
+        blobopen = getattr(self.conn, 'blobopen', None)  # Python 3.11
+        if blobopen:
+            row = self.conn.execute('SELECT rowid FROM responses WHERE key = ?', (key,)).fetchone()
+            if row:
+                with blobopen('responses', 'body', row[0], readonly=True) as blob:
+                    for chunk in iter(lambda: blob.read(chunk_size), b''):
+                        yield chunk
+                return
+        row = self.conn.execute('SELECT body FROM responses WHERE key = ?', (key,)).fetchone()
+        if row:
+            body = bytes(row[0])
+            for start in range(0, len(body), chunk_size):
+                yield body[start:start + chunk_size]
+
+    def set(self, key, body, ttl, etag=None, last_modified=None):
+        """Store a response body and evict the least recently used entries if the cache grew too big."""
+        now = time.time()
+        try:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (key, sqlite3.Binary(body), etag, last_modified, now + ttl, now, len(body)))
+            self.evict()
+        except sqlite3.Error:
+            pass
+
+    def set_file(self, key, body_file, size, ttl, etag=None, last_modified=None, chunk_size=64 * 1024):
+        """Store a response body spooled to body_file, copying it in chunks where sqlite allows."""
+        body_file.seek(0)
+        blobopen = getattr(self.conn, 'blobopen', None)
+        if not blobopen:
+            return self.set(key, body_file.read(), ttl, etag, last_modified)
+        now = time.time()
+        try:
+            self.conn.execute('BEGIN')  # readers never see the empty blob
+            try:
+                cursor = self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, zeroblob(?), ?, ?, ?, ?, ?)',
+                                           (key, size, etag, last_modified, now + ttl, now, size))
+                with blobopen('responses', 'body', cursor.lastrowid) as blob:
+                    for chunk in iter(lambda: body_file.read(chunk_size), b''):
+                        blob.write(chunk)
+            except (sqlite3.Error, ValueError):  # ValueError when the file outgrew size
+                self.conn.execute('ROLLBACK')
+                return None
+            self.conn.execute('COMMIT')
+            self.evict()
+        except sqlite3.Error:
+            pass
+
+    def touch(self, key, ttl):
+        """Extend the lifetime of an entry that was successfully revalidated."""
+        now = time.time()
+        try:
+            self.conn.execute('UPDATE responses SET expires = ?, accessed = ? WHERE key = ?', (now + ttl, now, key))
+        except sqlite3.Error:
+            pass
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_size."""
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        target = total - int(self.max_size * 0.9)
+        freed = 0
+        stale_keys = []
+        for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', stale_keys)
+
+    def clear(self):
+        """Remove all cached responses."""
+        try:
+            self.conn.execute('DELETE FROM responses')
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Fast lookups in the EPG of a channel
+"""
+import time
+import calendar
+from bisect import bisect_right
+
+
+def to_epoch(iso8601_string):
+    """Return the seconds since the epoch of an ISO 8601 string. UTC strings like
+    2019-03-11T20:00:00.000Z are sliced directly, anything else is left to iso8601."""
+    value = iso8601_string
+    if len(value) >= 20 and value[-1] == 'Z' and value[4] == '-' and value[10] == 'T':
+        try:
+            return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                    int(value[11:13]), int(value[14:16]), int(value[17:19]), 0, 0, 0))
+        except ValueError:
+            pass
+    import iso8601
+    return calendar.timegm(iso8601.parse_date(value).utctimetuple())
+
+
+class EpgIndex(object):
+    """The programs of a channel sorted by start time, searchable with bisect."""
+    __slots__ = ('starts', 'ends', 'programs')
+
+    def __init__(self, programs):
+        entries = []
+        for program in programs:
+            epg = program['epg']
+            entries.append((to_epoch(epg.get('startTime') or epg['start']),
+                            to_epoch(epg.get('endTime') or epg['end']), program))
+        entries.sort(key=lambda x: x[0])
+        self.starts = [x[0] for x in entries]
+        self.ends = [x[1] for x in entries]
+        self.programs = [x[2] for x in entries]
+
+    def __len__(self):
+        return len(self.programs)
+
+    def find(self, timestamp=None):
+        """Return the position of the program airing at timestamp (now by default) or None."""
+        if timestamp is None:
+            timestamp = time.time()
+        position = bisect_right(self.starts, timestamp) - 1
+        if position >= 0 and timestamp < self.ends[position]:
+            return position
+        return None
+
+    def at(self, timestamp):
+        """Return the program airing at timestamp or None."""
+        position = self.find(timestamp)
+        return self.programs[position] if position is not None else None
+
+    def now(self, timestamp=None):
+        """Return the program airing now or None."""
+        return self.at(time.time() if timestamp is None else timestamp)
+
+    def next(self, timestamp=None):
+        """Return the first program starting after timestamp (now by default) or None."""
+        if timestamp is None:
+            timestamp = time.time()
+        position = bisect_right(self.starts, timestamp)
+        return self.programs[position] if position < len(self.programs) else None
+
+    def progress(self, timestamp=None):
+        """Return how many percent of the current program have been aired or None."""
+        if timestamp is None:
+            timestamp = time.time()
+        position = self.find(timestamp)
+        if position is None:
+            return None
+        length = self.ends[position] - self.starts[position]
+        return int(100 * (timestamp - self.starts[position]) / length) if length else 100
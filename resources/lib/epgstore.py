@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+A persistent EPG store for the Viaplay library
+"""
+import json
+import sqlite3
+
+from .epg import to_epoch
+from .sqlitestore import SqliteStore
+
+
+class EpgStore(SqliteStore):
+    """Keeps the channels and programs of the channel pages in an SQLite database.
+    A page is served from disk until it is older than max_age or the stored schedule
+    of any of its channels ends within horizon seconds. Refreshing a page only replaces
+    the time window covered by the new schedules and programs older than keep are pruned."""
+    schema = (
+        'CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, fetched REAL, next_page TEXT, channel_ids TEXT)',
+        'CREATE TABLE IF NOT EXISTS channels (id TEXT PRIMARY KEY, data TEXT)',
+        'CREATE TABLE IF NOT EXISTS programs (channel_id TEXT, start INTEGER, end INTEGER, data TEXT, '
+        'PRIMARY KEY (channel_id, start))',
+        'CREATE INDEX IF NOT EXISTS programs_end ON programs (end)'
+    )
+
+    def __init__(self, db_path, max_age=1800, horizon=3600, keep=6 * 3600):
+        SqliteStore.__init__(self, db_path)
+        self.max_age = max_age
+        self.horizon = horizon
+        self.keep = keep
+
+    def get_page(self, url, now):
+        """Return the stored channels dict of a page or None when it's missing or stale."""
+        try:
+            page = self.conn.execute('SELECT fetched, next_page, channel_ids FROM pages WHERE url = ?',
+                                     (url,)).fetchone()
+            if not page or now - page[0] > self.max_age:
+                return None
+            channels = []
+            for channel_id in json.loads(page[2]):
+                row = self.conn.execute('SELECT data FROM channels WHERE id = ?', (channel_id,)).fetchone()
+                if not row:
+                    return None
+                programs = self.schedule(channel_id, now - self.keep)
+                if not programs or to_epoch(self.program_end(programs[-1])) < now + self.horizon:
+                    return None  # the schedule runs out soon
+                channel = json.loads(row[0])
+                channel['_embedded'] = {'viaplay:products': programs}
+                channels.append(channel)
+        except sqlite3.Error:
+            return None
+
+        return {
+            'channels': channels,
+            'next_page': page[1] or False
+        }
+
+    def store_page(self, url, channels_dict, now):
+        """Store the channels of a page, replacing the stored programs in the windows the new schedules cover."""
+        channel_ids = []
+        try:
+            with self.conn:
+                self.conn.execute('BEGIN')
+                for channel in channels_dict['channels']:
+                    channel_id = channel['_links']['self']['href']
+                    channel_ids.append(channel_id)
+                    channel_data = dict((k, v) for k, v in channel.items() if k not in ('_embedded', 'epg_index', 'art'))
+                    self.conn.execute('INSERT OR REPLACE INTO channels VALUES (?, ?)',
+                                      (channel_id, json.dumps(channel_data)))
+                    programs = [(to_epoch(self.program_start(x)), to_epoch(self.program_end(x)), x)
+                                for x in channel['_embedded']['viaplay:products']]
+                    if not programs:
+                        continue
+                    window_start = min(x[0] for x in programs)
+                    window_end = max(x[1] for x in programs)
+                    self.conn.execute('DELETE FROM programs WHERE channel_id = ? AND start < ? AND end > ?',
+                                      (channel_id, window_end, window_start))
+                    self.conn.executemany('INSERT OR REPLACE INTO programs VALUES (?, ?, ?, ?)',
+                                          [(channel_id, start, end, json.dumps(program))
+                                           for start, end, program in programs])
+                self.conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                                  (url, now, channels_dict['next_page'] or None, json.dumps(channel_ids)))
+                self.prune(now)
+        except sqlite3.Error:
+            pass
+
+    def schedule(self, channel_id, start, end=None):
+        """Return the stored programs of a channel airing between start and end (epoch seconds)."""
+        if end is None:
+            end = 2 ** 62
+        rows = self.conn.execute('SELECT data FROM programs WHERE channel_id = ? AND end > ? AND start < ? '
+                                 'ORDER BY start', (channel_id, start, end))
+        return [json.loads(x[0]) for x in rows]
+
+    def prune(self, now):
+        """Delete the programs that ended more than keep seconds ago."""
+        self.conn.execute('DELETE FROM programs WHERE end < ?', (now - self.keep,))
+
+    def clear(self):
+        try:
+            self.conn.executescript('DELETE FROM pages; DELETE FROM channels; DELETE FROM programs;')
+        except sqlite3.Error:
+            pass
+
+    @staticmethod
+    def program_start(program):
+        return program['epg'].get('startTime') or program['epg']['start']
+
+    @staticmethod
+    def program_end(program):
+        return program['epg'].get('endTime') or program['epg']['end']
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Export the Viaplay catalogue to JSON lines, outside of Kodi.
+Run from the add-on folder:
+    python -m resources.lib.export --country se --profile ~/.viaplay catalogue.jsonl
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .viaplay import Viaplay
+
+# root page entries that lead to collections of products
+SECTIONS = ('viaplay:root', 'series', 'movie', 'kids', 'rental', 'sport')
+
+
+class RateLimiter(object):
+    """Spaces out calls so that at most rate calls per second are started."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class CatalogueExporter(object):
+    """Walks root page -> sections -> collections -> product pages -> seasons -> episode pages
+    with a bounded number of workers and writes every product to a JSON lines file as soon as it's found.
+    Finished and pending pages are checkpointed along with the size of the output at that point, so an interrupted
+    export can be resumed. Whatever was written after the last checkpoint is cut off and fetched again."""
+
+    def __init__(self, vp, output_file, checkpoint_file, workers=4, rate=4, checkpoint_interval=20):
+        self.vp = vp
+        self.output_file = output_file
+        self.checkpoint_file = checkpoint_file
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.checkpoint_interval = checkpoint_interval
+        self.done = set()
+        self.pending = []
+        self.seen_products = set()
+        self.offset = None  # size of the output at the last checkpoint
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, 'r') as checkpoint:
+                state = json.load(checkpoint)
+        except (IOError, ValueError):
+            return False
+        self.done = set(state['done'])
+        self.pending = [tuple(x) for x in state['pending']]
+        self.seen_products = set(state['seen_products'])
+        self.offset = state.get('offset')
+        return True
+
+    def save_checkpoint(self, in_flight, offset):
+        in_flight = list(in_flight)
+        state = {
+            'done': sorted(self.done - set(x[1] for x in in_flight)),
+            'pending': self.pending + in_flight,  # unfinished pages are retried on resume
+            'seen_products': sorted(self.seen_products),
+            'offset': offset
+        }
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def fetch(self, task):
+        """Fetch one page. Return the product records and the follow-up tasks."""
+        kind, url = task
+        self.limiter.wait()
+        records = []
+        tasks = []
+        if kind == 'root':
+            for page in self.vp.get_root_page():
+                if page.get('name') in SECTIONS or page.get('type') in SECTIONS:
+                    tasks.append(('section', page['href']))
+        elif kind == 'section':
+            for collection in self.vp.get_collections(url):
+                tasks.append(('products', collection['_links']['self']['href']))
+        elif kind == 'series':
+            for season in self.vp.get_seasons(url):
+                tasks.append(('products', season['_links']['self']['href']))
+        else:  # products
+            products_dict = self.vp.get_products(url, normalize=False)
+            for product in products_dict['products']:
+                records.append({'page': url, 'product': product})
+                if product['type'] == 'series' and 'viaplay:page' in product['_links']:
+                    tasks.append(('series', product['_links']['viaplay:page']['href']))
+            if products_dict['next_page']:
+                tasks.append(('products', products_dict['next_page']))
+        return records, tasks
+
+    def product_id(self, product):
+        return product.get('system', {}).get('guid') or product['_links']['self']['href']
+
+    def run(self):
+        """Export until there's nothing left to fetch. Return the number of products written."""
+        if not self.load_checkpoint():
+            self.pending = [('root', self.vp.base_url)]
+        written = 0
+        finished = 0
+        with open(self.output_file, 'a') as output, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            if self.offset is not None:
+                output.truncate(self.offset)  # drop the products of pages that aren't in the checkpoint
+            in_flight = {}
+            while self.pending or in_flight:
+                while self.pending and len(in_flight) < self.workers:
+                    task = self.pending.pop(0)
+                    if task[1] in self.done:
+                        continue
+                    self.done.add(task[1])  # don't queue the same page twice
+                    in_flight[executor.submit(self.fetch, task)] = task
+                if not in_flight:
+                    continue
+                completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    task = in_flight.pop(future)
+                    try:
+                        records, tasks = future.result()
+                    except Viaplay.ViaplayError:
+                        raise
+                    except Exception as error:
+                        sys.stderr.write('Failed to fetch {0}: {1}\n'.format(task[1], error))
+                        continue
+                    for record in records:
+                        product_id = self.product_id(record['product'])
+                        if product_id not in self.seen_products:
+                            self.seen_products.add(product_id)
+                            output.write(json.dumps(record) + '\n')
+                            written += 1
+                    self.pending.extend(x for x in tasks if x[1] not in self.done)
+                    finished += 1
+                    if finished % self.checkpoint_interval == 0:
+                        output.flush()
+                        self.save_checkpoint(in_flight.values(), output.tell())
+            output.flush()
+            self.save_checkpoint([], output.tell())
+
+        return written
+
+
+def login(vp):
+    """Register the device with a code entered on the Viaplay website."""
+    activation_data = vp.get_activation_data()
+    print('Go to {0} and enter the code {1}'.format(activation_data['verificationUrl'], activation_data['userCode']))
+    expires = time.time() + activation_data['expires']
+    while time.time() < expires:
+        time.sleep(activation_data['interval'])
+        try:
+            return vp.authorize_device(activation_data)
+        except vp.ViaplayError as error:
+            if error.value != b'DeviceAuthorizationPendingError':
+                raise
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the Viaplay catalogue to JSON lines.')
+    parser.add_argument('output', help='JSON lines file to append the products to')
+    parser.add_argument('--country', default='se', choices=('se', 'dk', 'no', 'fi'))
+    parser.add_argument('--profile', default=os.path.expanduser('~/.viaplay'),
+                        help='folder for the session cookies and caches (a Kodi add-on profile works too)')
+    parser.add_argument('--checkpoint', help='checkpoint file, defaults to OUTPUT.checkpoint')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=4, help='max requests per second')
+    parser.add_argument('--login', action='store_true', help='register this device before exporting')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args(argv)
+
+    vp = Viaplay(args.profile, args.country, args.debug)
+    if args.login and not login(vp):
+        sys.stderr.write('Device registration failed.\n')
+        return 1
+    exporter = CatalogueExporter(vp, args.output, args.checkpoint or args.output + '.checkpoint',
+                                 workers=args.workers, rate=args.rate)
+    try:
+        written = exporter.run()
+    except Viaplay.ViaplayError as error:
+        sys.stderr.write('Viaplay error: {0}\n'.format(error))
+        return 1
+    print('Wrote {0} products to {1}'.format(written, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
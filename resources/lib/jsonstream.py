@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Extraction of a few paths from large JSON documents without building the whole document
+"""
+import re
+import json
+
+WHITESPACE_PATTERN = re.compile(rb'[ \t\r\n]*')
+STRING_PATTERN = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+LITERAL_PATTERN = re.compile(rb'[^ \t\r\n{}\[\],:"]+')
+# anything up to the next bracket that isn't in a string
+SKIP_PATTERN = re.compile(rb'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+PATH_PATTERN = re.compile(r'([^.\[\]{}]+)|\[(\*|\d+)\]|\{([^}]*)\}')
+
+
+def parse_path(path):
+    """Parse a path like '_embedded.viaplay:blocks[*].{type,_links}' into a tuple of steps.
+    A step is a key, an index, '*' for any index or a frozenset of keys."""
+    steps = []
+    for key, index, keys in PATH_PATTERN.findall(path):
+        if key:
+            steps.append(key)
+        elif index:
+            steps.append(index if index == '*' else int(index))
+        else:
+            steps.append(frozenset(x.strip() for x in keys.split(',')))
+    return tuple(steps)
+
+
+def step_matches(step, key):
+    if isinstance(step, frozenset):
+        return key in step
+    if step == '*':
+        return isinstance(key, int)
+    return step == key
+
+
+class JsonExtractor(object):
+    """Reads a JSON document from an iterable of bytes chunks and yields (path, value) for the values
+    at the requested paths. Everything else is skipped without being decoded, and only the chunks
+    holding the value being read are kept in memory."""
+
+    def __init__(self, chunks, paths, loads=json.loads):
+        self.chunks = iter(chunks)
+        self.patterns = [parse_path(x) for x in paths]
+        self.loads = loads
+        self.buffer = b''
+        self.pos = 0
+        self.mark = None  # start of the value being captured
+        self.eof = False
+
+    def fill(self):
+        """Read the next chunk, dropping what has been read unless it's being captured. Return False at the end."""
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            return False
+        keep = self.pos if self.mark is None else self.mark
+        self.buffer = self.buffer[keep:] + chunk
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark -= keep
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            self.pos = WHITESPACE_PATTERN.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('Expected {0} at {1}'.format(character, self.pos))
+        self.pos += 1
+
+    def read_string(self):
+        """Return the raw bytes of the string at the current position, including the quotes."""
+        self.peek()
+        while True:
+            match = STRING_PATTERN.match(self.buffer, self.pos)
+            if match:
+                self.pos = match.end()
+                return match.group()
+            if not self.fill():
+                raise ValueError('Unterminated string')
+
+    def read_literal(self):
+        while True:
+            match = LITERAL_PATTERN.match(self.buffer, self.pos)
+            if match and (match.end() < len(self.buffer) or self.eof):
+                self.pos = match.end()
+                return match.group()
+            if not self.fill():
+                if match:
+                    continue
+                raise ValueError('Expected a value at {0}'.format(self.pos))
+
+    def skip_value(self):
+        character = self.peek()
+        if character == b'"':
+            self.read_string()
+        elif character in (b'{', b'['):
+            depth = 0
+            while True:
+                self.pos = SKIP_PATTERN.match(self.buffer, self.pos).end()
+                character = self.buffer[self.pos:self.pos + 1]
+                if not character or character == b'"':  # the chunk ends, maybe inside a string
+                    if not self.fill():
+                        raise ValueError('Unterminated value')
+                    continue
+                self.pos += 1
+                depth += 1 if character in (b'{', b'[') else -1
+                if depth == 0:
+                    return
+        else:
+            self.read_literal()
+
+    def action(self, path):
+        """Return 'capture' if a pattern ends at path, 'descend' if one goes deeper and 'skip' otherwise."""
+        action = 'skip'
+        for pattern in self.patterns:
+            if len(pattern) < len(path) or not all(step_matches(s, k) for s, k in zip(pattern, path)):
+                continue
+            if len(pattern) == len(path):
+                return 'capture'
+            action = 'descend'
+        return action
+
+    def read_value(self, path):
+        action = self.action(path)
+        if action == 'capture':
+            self.peek()
+            self.mark = self.pos
+            self.skip_value()
+            value = self.loads(self.buffer[self.mark:self.pos])
+            self.mark = None
+            yield path, value
+        elif action == 'skip':
+            self.skip_value()
+        elif self.peek() == b'{':
+            self.pos += 1
+            if self.peek() == b'}':
+                self.pos += 1
+                return
+            while True:
+                key = self.read_string()
+                key = key[1:-1].decode('utf-8') if b'\\' not in key else json.loads(key)
+                self.expect(b':')
+                for item in self.read_value(path + (key,)):
+                    yield item
+                if self.peek() == b'}':
+                    self.pos += 1
+                    return
+                self.expect(b',')
+        elif self.peek() == b'[':
+            self.pos += 1
+            if self.peek() == b']':
+                self.pos += 1
+                return
+            index = 0
+            while True:
+                for item in self.read_value(path + (index,)):
+                    yield item
+                index += 1
+                if self.peek() == b']':
+                    self.pos += 1
+                    return
+                self.expect(b',')
+        else:
+            self.skip_value()
+
+    def __iter__(self):
+        return self.read_value(())
+
+
+class Skeleton(dict):
+    """A container on the way to the extracted values."""
+
+
+def extract(chunks, paths, loads=json.loads):
+    """Return a document holding only the values at paths, with the same shape as the full document.
+    Lists only contain the items that had something extracted, in their original order."""
+    document = Skeleton()
+    for path, value in JsonExtractor(chunks, paths, loads):
+        node = document
+        for key in path[:-1]:
+            node = node.setdefault(key, Skeleton())
+        node[path[-1]] = value
+    return to_lists(document)
+
+
+def to_lists(node):
+    """Turn the skeleton dicts keyed by list indexes into lists."""
+    if not isinstance(node, Skeleton):
+        return node
+    if node and all(isinstance(x, int) for x in node):
+        return [to_lists(node[x]) for x in sorted(node)]
+    return dict((key, to_lists(value)) for key, value in node.items())
+
+
+def iter_chunks(content, chunk_size=64 * 1024):
+    """Yield a bytes body in chunks."""
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
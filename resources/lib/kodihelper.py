@@ -1,47 +1,127 @@
+import os
+import time
+from urllib.parse import urlsplit, quote
+
 from .viaplay import Viaplay
+from .prefetch import Prefetcher
+from .artwork import QUALITY_PROFILES
+from .remote import ServiceClient, RemoteViaplay
+from .tracing import Tracer, PhaseTimer
+from .listings import ListingStore
 
 import xbmc
 import xbmcvfs
 import xbmcgui
 import xbmcplugin
-import inputstreamhelper
 from xbmcaddon import Addon
 
 
 class KodiHelper(object):
+    subtitle_wait = 1.5  # seconds the start of playback may wait for the subtitles
+    # subtitle languages of each site that are downloaded before playback starts, besides the Kodi language
+    subtitle_languages = {'se': ('sv',), 'dk': ('da',), 'no': ('no', 'nb'), 'fi': ('fi', 'sv')}
+
     def __init__(self, base_url=None, handle=None):
-        addon = self.get_addon()
+        self.addon = Addon()
+        self.settings = {}  # settings and strings read during this invocation
+        self.strings = {}
         self.base_url = base_url
         self.handle = handle
-        self.addon_path = xbmcvfs.translatePath(addon.getAddonInfo('path'))
-        self.addon_profile = xbmcvfs.translatePath(addon.getAddonInfo('profile'))
-        self.addon_name = addon.getAddonInfo('id')
-        self.addon_version = addon.getAddonInfo('version')
-        self.language = addon.getLocalizedString
+        self.addon_path = xbmcvfs.translatePath(self.addon.getAddonInfo('path'))
+        self.addon_profile = xbmcvfs.translatePath(self.addon.getAddonInfo('profile'))
+        self.addon_name = self.addon.getAddonInfo('id')
+        self.addon_version = self.addon.getAddonInfo('version')
+        self.addon_icon = self.addon.getAddonInfo('icon')
+        self.addon_fanart = self.addon.getAddonInfo('fanart')
         self.logging_prefix = '[%s-%s]' % (self.addon_name, self.addon_version)
-        if not xbmcvfs.exists(self.addon_profile):
-            xbmcvfs.mkdir(self.addon_profile)
-        if self.get_setting('first_run'):
-            self.get_addon().openSettings()
+        if handle is not None and self.get_setting('first_run'):  # not from the service
+            self.addon.openSettings()
+            self.settings = {}  # any setting may have been changed
             self.set_setting('first_run', 'false')
-        self.vp = Viaplay(self.addon_profile, self.get_country_code(), True)
+        self._vp = None
+        self._prefetcher = None
+        self.items = []  # directory items of the listing being built
+        self.content = None
+        self._listing_store = None
+        self.listing_key = None  # set when the listing being built is to be stored
+        self.item_specs = []
+
+    @property
+    def vp(self):
+        """The Viaplay client. Created on first use since not every route needs it.
+        When the service is running, the network calls are made by its warm client."""
+        if self._vp is None:
+            service = None
+            if self.get_setting('use_service'):
+                service = ServiceClient.find(os.path.join(self.addon_profile, 'service.json'),
+                                             self.get_country_code())
+            if service:
+                self._vp = RemoteViaplay(service, self.create_viaplay)
+            else:
+                self._vp = self.create_viaplay()
+        return self._vp
+
+    def request_stats(self):
+        """Return the number of requests and bytes downloaded during this invocation.
+        Calls to the service count as one request each."""
+        requests = bytes_downloaded = 0
+        vp = self._vp
+        if isinstance(vp, RemoteViaplay):
+            requests += vp.client.calls
+            bytes_downloaded += vp.client.bytes
+            vp = vp._local
+        if vp is not None:
+            requests += vp.tracer.requests
+            bytes_downloaded += vp.tracer.bytes
+        return requests, bytes_downloaded
+
+    @property
+    def listing_store(self):
+        if self._listing_store is None:
+            self._listing_store = ListingStore(os.path.join(self.addon_profile, 'listings.db'))
+        return self._listing_store
+
+    def create_viaplay(self):
+        """Return a new in-process Viaplay client."""
+        debug = xbmc.getCondVisibility('System.GetBool(debug.showloginfo)')
+        vp = Viaplay(self.addon_profile, self.get_country_code(), debug, self.get_setting('trace_requests'),
+                     self.get_setting('local_search'),
+                     QUALITY_PROFILES[int(self.get_setting('artwork_quality') or 1)], self.get_setting('low_memory'))
+        if self.base_url:
+            vp.tracer.route = urlsplit(self.base_url).path
+        return vp
+
+    @property
+    def prefetcher(self):
+        if self._prefetcher is None:
+            history_file = os.path.join(self.addon_profile, 'navigation.json')
+            self._prefetcher = Prefetcher(lambda: self.vp, self.log, history_file)
+        return self._prefetcher
 
     def get_addon(self):
-        """Returns a fresh addon instance."""
-        return Addon()
+        """Returns the addon instance of this invocation."""
+        return self.addon
 
     def get_setting(self, setting_id):
-        addon = self.get_addon()
-        setting = addon.getSetting(setting_id)
-        if setting == 'true':
-            return True
-        elif setting == 'false':
-            return False
-        else:
-            return setting
+        """Return a setting. Each setting is only read once per invocation."""
+        if setting_id not in self.settings:
+            setting = self.addon.getSetting(setting_id)
+            if setting == 'true':
+                setting = True
+            elif setting == 'false':
+                setting = False
+            self.settings[setting_id] = setting
+        return self.settings[setting_id]
 
     def set_setting(self, key, value):
-        return self.get_addon().setSetting(key, value)
+        self.settings.pop(key, None)
+        return self.addon.setSetting(key, value)
+
+    def language(self, string_id):
+        """Return a localized string. Each string is only read once per invocation."""
+        if string_id not in self.strings:
+            self.strings[string_id] = self.addon.getLocalizedString(string_id)
+        return self.strings[string_id]
 
     def log(self, string):
         msg = '%s: %s' % (self.logging_prefix, string)
@@ -77,6 +157,7 @@ class KodiHelper(object):
         confirm = self.dialog('yesno', self.language(30042), self.language(30043))
         if confirm:
             self.vp.log_out()
+            self.listing_store.clear()
             # send Kodi back to home screen
             xbmc.executebuiltin("Action(Back,%s)" % xbmcgui.getCurrentWindowId())
 
@@ -104,6 +185,7 @@ class KodiHelper(object):
         while not xbmc.Monitor().abortRequested() and secs < expires:
             try:
                 self.vp.authorize_device(activation_data)
+                self.listing_store.clear()
                 dialog.close()
                 return True
             except self.vp.ViaplayError as error:
@@ -151,7 +233,9 @@ class KodiHelper(object):
             return None
 
     def add_item(self, title, url, folder=True, playable=False, info=None, art=None, content=False):
-        addon = self.get_addon()
+        if self.listing_key:
+            self.item_specs.append({'title': title, 'url': url, 'folder': folder, 'playable': playable,
+                                    'info': info, 'art': art, 'content': content})
         listitem = xbmcgui.ListItem(label=title)
 
         if playable:
@@ -159,46 +243,102 @@ class KodiHelper(object):
             folder = False
         if art:
             listitem.setArt(art)
+            if self.get_setting('warm_artwork'):
+                self.prefetcher.add_image(art.get('poster') or art.get('thumb'))
         else:
             art = {
-                'icon': addon.getAddonInfo('icon'),
-                'fanart': addon.getAddonInfo('fanart')
+                'icon': self.addon_icon,
+                'fanart': self.addon_fanart
             }
             listitem.setArt(art)
         if info:
             listitem.setInfo('video', info)
         if content:
-            xbmcplugin.setContent(self.handle, content)
+            self.content = content
+
+        self.items.append((url, listitem, folder))
 
-        xbmcplugin.addDirectoryItem(self.handle, url, listitem, folder)
+    def prefetch(self, url, weight=1):
+        """Queue a URL the user is likely to open from the current listing."""
+        self.prefetcher.add(url, weight)
 
-    def eod(self):
-        """Tell Kodi that the end of the directory listing is reached."""
-        xbmcplugin.endOfDirectory(self.handle)
+    def eod(self, cache_to_disc=True):
+        """Hand all items of the listing to Kodi at once and tell Kodi that the end of the directory listing
+        is reached. Warm the cache with the queued URLs once the listing is shown."""
+        if self.content:
+            xbmcplugin.setContent(self.handle, self.content)
+        xbmcplugin.addDirectoryItems(self.handle, self.items, len(self.items))
+        xbmcplugin.addSortMethod(self.handle, xbmcplugin.SORT_METHOD_UNSORTED)
+        if self.content in ('movies', 'tvshows'):
+            xbmcplugin.addSortMethod(self.handle, xbmcplugin.SORT_METHOD_LABEL_IGNORE_THE)
+            xbmcplugin.addSortMethod(self.handle, xbmcplugin.SORT_METHOD_VIDEO_YEAR)
+        xbmcplugin.endOfDirectory(self.handle, cacheToDisc=cache_to_disc)
+        if self.listing_key:
+            self.listing_store.set(self.listing_key, {'items': self.item_specs, 'cache_to_disc': cache_to_disc},
+                                   time.time())
+            self.listing_key = None
+            self.item_specs = []
+        self.items = []
+        self.content = None
+        if self._prefetcher:
+            if not self.get_setting('prefetch'):
+                self._prefetcher.candidates = {}  # only warm the artwork
+            self._prefetcher.save_history()
+            self._prefetcher.run()
+
+    def replay_listing(self, key, max_age):
+        """Render the listing stored for key if it's younger than max_age seconds. Return True if it was.
+        Otherwise the listing built next is stored under key."""
+        if not max_age or not self.get_setting('store_listings'):
+            return False
+        key = ListingStore.make_key(key, self.get_setting)
+        listing = self.listing_store.get(key, max_age, time.time())
+        if listing is None:
+            self.listing_key = key
+            return False
+        for spec in listing['items']:
+            self.add_item(**spec)
+        if self._prefetcher:
+            self._prefetcher.images = []  # warmed when the listing was stored
+        self.eod(cache_to_disc=listing['cache_to_disc'])
+        return True
 
     def play(self, guid=None, url=None, pincode=None, tve='false'):
-        if url and url != 'None':
-            guid = self.vp.get_products(url)['products'][0]['system']['guid']
+        """Resolve the stream while InputStream Helper checks the add-ons, and download the subtitles
+        without holding up the start of playback for more than subtitle_wait seconds."""
+        timer = PhaseTimer('Playback start')
+        resolved = {'guid': guid}
+        from concurrent.futures import ThreadPoolExecutor, wait  # deferred, slow to import
+        executor = ThreadPoolExecutor(max_workers=2)
         try:
-            stream = self.vp.get_stream(guid, pincode=pincode, tve=tve)
-        except self.vp.ViaplayError as error:
-            if error.value == b'MissingSessionCookieError':
-                self.authorize()
-                return
-            if error.value == b'ParentalGuidancePinChallengeNeededError':
-                if pincode:
-                    self.dialog(dialog_type='ok', heading=self.language(30033), message=self.language(30034))
-                else:
-                    pincode = self.get_numeric_input(self.language(30032))
-                    if pincode:
-                        self.play(guid, pincode=pincode)
+            stream_future = executor.submit(self.resolve_stream, resolved, timer, url, pincode, tve)
+            import inputstreamhelper  # deferred, only needed for playback
+            with timer.phase('ia_check'):
+                ia_ready = inputstreamhelper.Helper('mpd', drm='widevine').check_inputstream()
+            try:
+                stream = stream_future.result()
+            except self.vp.ViaplayError as error:
+                if error.value == b'MissingSessionCookieError':
+                    self.authorize()
                     return
-            else:
-                raise
+                if error.value == b'ParentalGuidancePinChallengeNeededError':
+                    if pincode:
+                        self.dialog(dialog_type='ok', heading=self.language(30033), message=self.language(30034))
+                    else:
+                        pincode = self.get_numeric_input(self.language(30032))
+                        if pincode:
+                            self.play(resolved['guid'], pincode=pincode)
+                        return
+                else:
+                    raise
+            if not ia_ready:
+                return
 
-        ia_helper = inputstreamhelper.Helper('mpd', drm='widevine')
-        if ia_helper.check_inputstream():
-            playitem = xbmcgui.ListItem(path=stream['mpd_url'])
+            subtitles_future = None
+            preferred_subtitles, other_subtitles = self.split_subtitles(stream.get('subtitles', []))
+            if preferred_subtitles:
+                subtitles_future = executor.submit(self.download_subtitles, preferred_subtitles, timer)
+            playitem = xbmcgui.ListItem(path=self.get_manifest_url(stream['mpd_url']))
             playitem.setContentLookup(False)
             playitem.setMimeType('application/xml+dash')  # prevents HEAD request that causes 404 error
             playitem.setProperty('inputstream', 'inputstream.adaptive')
@@ -207,9 +347,80 @@ class KodiHelper(object):
             playitem.setProperty('inputstream.adaptive.license_type', 'com.widevine.alpha')
             playitem.setProperty('inputstream.adaptive.license_key',
                                  stream['license_url'].replace('{widevineChallenge}', 'B{SSM}') + '|||JBlicense')
-            if 'subtitles' in stream:
-                playitem.setSubtitles(self.vp.download_subtitles(stream['subtitles']))
+            late_subtitles = []
+            if subtitles_future:
+                wait([subtitles_future], timeout=self.subtitle_wait)
+                if subtitles_future.done():
+                    playitem.setSubtitles(subtitles_future.result())
+                    subtitles_future = None
             xbmcplugin.setResolvedUrl(self.handle, True, listitem=playitem)
+            timer.mark('resolved')
+            if other_subtitles:
+                late_subtitles.extend(self.download_subtitles(other_subtitles, timer, 'other_subtitles'))
+            if subtitles_future:
+                late_subtitles.extend(subtitles_future.result())
+            if late_subtitles:
+                self.add_late_subtitles(late_subtitles)
+        finally:
+            executor.shutdown(wait=False)
+            self.report_timings(timer)
+
+    def get_manifest_url(self, mpd_url):
+        """Return the URL of the manifest proxy of the service for mpd_url, or mpd_url when it's not running."""
+        service = getattr(self.vp, 'service', None)
+        if self.get_setting('manifest_proxy') and service and service.manifest_proxy:
+            return service.manifest_proxy + quote(mpd_url, safe='')
+        return mpd_url
+
+    def resolve_stream(self, resolved, timer, url, pincode, tve):
+        """Return the stream of the product at url or with guid resolved['guid']."""
+        if url and url != 'None':
+            with timer.phase('guid'):
+                resolved['guid'] = self.vp.get_products(url)['products'][0].guid
+        with timer.phase('stream'):
+            return self.vp.get_stream(resolved['guid'], pincode=pincode, tve=tve)
+
+    def preferred_languages(self):
+        """Return the language codes of the site and of the Kodi interface."""
+        languages = set(self.subtitle_languages[self.get_country_code()])
+        languages.add(xbmc.getLanguage(xbmc.ISO_639_1))
+        return languages
+
+    def split_subtitles(self, subtitles):
+        """Split the subtitles into the ones in the preferred languages, downloaded before playback starts,
+        and the others, added once playback has started."""
+        languages = self.preferred_languages()
+        preferred = [x for x in subtitles if x.get('languageCode') in languages]
+        return preferred, [x for x in subtitles if x not in preferred]
+
+    def download_subtitles(self, subtitles, timer, phase='subtitles'):
+        """Return the paths of the downloaded subtitles. A failure means playing without subtitles."""
+        with timer.phase(phase):
+            try:
+                return self.vp.download_subtitles(subtitles)
+            except Exception as error:  # subtitles are never worth failing playback for
+                self.log('Failed to download subtitles: %s' % error)
+                return []
+
+    def add_late_subtitles(self, paths, timeout=30):
+        """Add subtitles that weren't ready at playback start to the player, without turning them on."""
+        player = xbmc.Player()
+        monitor = xbmc.Monitor()
+        while not player.isPlayingVideo():
+            timeout -= 0.25
+            if timeout < 0 or monitor.waitForAbort(0.25):
+                return
+        shown = xbmc.getCondVisibility('VideoPlayer.SubtitlesEnabled')
+        for path in paths:
+            player.setSubtitles(path)
+        if not shown:
+            player.showSubtitles(False)
+
+    def report_timings(self, timer):
+        """Log the timings and record them in playback.jsonl when requests are traced."""
+        self.log(timer.summary())
+        if self.get_setting('trace_requests'):
+            Tracer(os.path.join(self.addon_profile, 'playback.jsonl')).finish(timer.record)
 
     def ia_settings(self):
         """Open InputStream Adaptive settings."""
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+A store of rendered directory listings, so revisited routes can skip the network and the mapping
+"""
+import json
+import sqlite3
+
+from .sqlitestore import SqliteStore
+
+
+class ListingStore(SqliteStore):
+    """Keeps the item specs of rendered listings in SQLite, keyed by the plugin URL and the settings that
+    change how a listing looks. Listings are kept for keep seconds; how old a listing may be to be reused
+    is up to the route."""
+    schema = ('CREATE TABLE IF NOT EXISTS listings (key TEXT PRIMARY KEY, data TEXT, created REAL)',)
+    settings = ('site', 'items_per_listing', 'artwork_quality')
+
+    def __init__(self, db_path, keep=24 * 3600):
+        SqliteStore.__init__(self, db_path)
+        self.keep = keep
+
+    @classmethod
+    def make_key(cls, url, get_setting):
+        """Return the key of the listing of the plugin URL url, get_setting returns the value of a setting."""
+        return '{0}#{1}'.format(url, ','.join(str(get_setting(x)) for x in cls.settings))
+
+    def get(self, key, max_age, now):
+        """Return the listing stored for key or None when it's missing or older than max_age seconds."""
+        try:
+            row = self.conn.execute('SELECT data FROM listings WHERE key = ? AND created > ?',
+                                    (key, now - max_age)).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, listing, now):
+        try:
+            self.conn.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?)',
+                              (key, json.dumps(listing, default=str), now))
+            self.conn.execute('DELETE FROM listings WHERE created < ?', (now - self.keep,))
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        try:
+            self.conn.execute('DELETE FROM listings')
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+A localhost proxy serving MPEG-DASH manifests trimmed to what the device can play
+"""
+import time
+import threading
+import xml.etree.ElementTree as ET
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urljoin, urlsplit, parse_qs
+
+MPD_NS = 'urn:mpeg:dash:schema:mpd:2011'
+# keep the usual prefixes in the rewritten manifest
+NAMESPACES = {
+    '': MPD_NS,
+    'cenc': 'urn:mpeg:cenc:2013',
+    'mspr': 'urn:microsoft:playready',
+    'xlink': 'http://www.w3.org/1999/xlink',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance'
+}
+for _prefix, _uri in NAMESPACES.items():
+    ET.register_namespace(_prefix, _uri)
+
+
+def tag(name):
+    return '{%s}%s' % (MPD_NS, name)
+
+
+# the attributes holding segment URLs, per element
+URL_ATTRIBUTES = {
+    tag('SegmentTemplate'): ('media', 'initialization', 'index'),
+    tag('SegmentURL'): ('media', 'index'),
+    tag('Initialization'): ('sourceURL',),
+    tag('RepresentationIndex'): ('sourceURL',)
+}
+
+
+def content_type(adaptation_set):
+    """Return 'video', 'audio', 'text' or None for an AdaptationSet."""
+    if adaptation_set.get('contentType'):
+        return adaptation_set.get('contentType')
+    mime_type = adaptation_set.get('mimeType') or ''
+    for representation in adaptation_set.iter(tag('Representation')):
+        mime_type = mime_type or representation.get('mimeType') or ''
+    if mime_type.startswith('application/'):
+        return 'text'
+    return mime_type.split('/')[0] or None
+
+
+class ManifestFilter(object):
+    """Removes the video representations above max_height and max_bandwidth (0 means no cap),
+    keeps the codec starting with codec when there's a choice and, when languages is set, drops the
+    audio and subtitle adaptation sets in other languages as long as one in those languages remains.
+    The remaining video representations are ordered by bandwidth, best first."""
+
+    def __init__(self, max_height=0, max_bandwidth=0, codec=None, languages=None):
+        self.max_height = max_height
+        self.max_bandwidth = max_bandwidth
+        self.codec = codec
+        self.languages = languages
+
+    def apply(self, manifest, base_url):
+        """Return the filtered manifest. base_url is where it was downloaded from,
+        the segment URLs are made absolute since the manifest is served from elsewhere."""
+        root = ET.fromstring(manifest)
+        self.make_absolute(root, base_url)
+        for period in root.iter(tag('Period')):
+            adaptation_sets = period.findall(tag('AdaptationSet'))
+            for adaptation_set in adaptation_sets:
+                if content_type(adaptation_set) == 'video':
+                    self.filter_video(adaptation_set)
+            if self.languages:
+                for kind in ('audio', 'text'):
+                    self.filter_languages(period, [x for x in adaptation_sets if content_type(x) == kind])
+
+        return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+    @staticmethod
+    def make_absolute(root, base_url):
+        """Point the top level BaseURL at the original location, the nested ones are relative to it.
+        Location elements are removed so that live updates come through the proxy too, and the
+        query of base_url is kept on the segment URLs."""
+        for element in root.findall(tag('Location')):
+            root.remove(element)
+        base_urls = root.findall(tag('BaseURL'))
+        for element in base_urls:
+            element.text = urljoin(base_url, (element.text or '').strip())
+        if not base_urls:
+            element = ET.Element(tag('BaseURL'))
+            element.text = urljoin(base_url, '.')
+            position = len([x for x in root if x.tag == tag('ProgramInformation')])
+            root.insert(position, element)
+        query = urlsplit(base_url).query
+        if query:
+            origin = urlsplit(base_url).netloc
+            ManifestFilter.add_query(root, query, urlsplit(root.find(tag('BaseURL')).text).netloc, origin)
+
+    @staticmethod
+    def add_query(element, query, netloc, origin):
+        """Append the query of the manifest URL to the segment URLs below element, it often carries
+        the CDN token and is lost when they are resolved against a BaseURL. Only URLs without a query
+        of their own that point at the host of the manifest (origin) get it, netloc is the host the
+        relative URLs below element resolve to."""
+        for child in element:
+            if child.tag == tag('BaseURL'):
+                continue
+            child_netloc = netloc
+            for base in child.findall(tag('BaseURL')):
+                text = (base.text or '').strip()
+                child_netloc = urlsplit(text).netloc or netloc
+                if child_netloc == origin and '?' not in text:
+                    base.text = '{0}?{1}'.format(text, query)
+            # a $ in a template starts an identifier, $$ is a literal one
+            suffix = query.replace('$', '$$') if child.tag == tag('SegmentTemplate') else query
+            for attribute in URL_ATTRIBUTES.get(child.tag, ()):
+                value = child.get(attribute)
+                if value and child_netloc == origin and '?' not in value and not urlsplit(value).netloc:
+                    child.set(attribute, '{0}?{1}'.format(value, suffix))
+            ManifestFilter.add_query(child, query, child_netloc, origin)
+
+    def filter_video(self, adaptation_set):
+        representations = adaptation_set.findall(tag('Representation'))
+
+        def codec(representation):
+            return representation.get('codecs') or adaptation_set.get('codecs') or ''
+
+        def allowed(representation):
+            height = int(representation.get('height') or adaptation_set.get('height') or 0)
+            bandwidth = int(representation.get('bandwidth') or 0)
+            return ((not self.max_height or height <= self.max_height) and
+                    (not self.max_bandwidth or bandwidth <= self.max_bandwidth))
+
+        keep = [x for x in representations if allowed(x)]
+        if self.codec and any(codec(x).startswith(self.codec) for x in keep):
+            keep = [x for x in keep if codec(x).startswith(self.codec)]
+        if not keep:  # never leave the adaptation set empty, keep the lowest representation
+            keep = [min(representations, key=lambda x: int(x.get('bandwidth') or 0))]
+        for representation in representations:
+            adaptation_set.remove(representation)
+        keep.sort(key=lambda x: int(x.get('bandwidth') or 0), reverse=True)
+        for representation in keep:
+            adaptation_set.append(representation)
+
+    def filter_languages(self, period, adaptation_sets):
+        preferred = [x for x in adaptation_sets if (x.get('lang') or '').split('-')[0] in self.languages]
+        if not preferred:
+            return
+        for adaptation_set in adaptation_sets:
+            if adaptation_set not in preferred and adaptation_set.get('lang'):
+                period.remove(adaptation_set)
+
+
+class ManifestProxy(ThreadingMixIn, HTTPServer):
+    """Serves filtered manifests on localhost. The upstream manifest URL is passed in the url parameter
+    of the proxy URL, which stays the same for every update of a live manifest. Manifests are cached
+    for static_ttl seconds, or dynamic_ttl seconds for live ones."""
+    daemon_threads = True
+    static_ttl = 60
+    dynamic_ttl = 1
+
+    def __init__(self, vp, manifest_filter, token):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ManifestRequestHandler)
+        self.vp = vp
+        self.manifest_filter = manifest_filter
+        self.token = token
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        """The proxy URL, the upstream manifest URL is appended to it."""
+        return 'http://127.0.0.1:{0}/{1}/manifest.mpd?url='.format(self.server_address[1], self.token)
+
+    def get_manifest(self, url):
+        with self.lock:
+            cached = self.cache.get(url)
+        if cached and cached[0] > time.time():
+            return cached[1]
+        req = self.vp.http_session.get(url, timeout=self.vp.get_timeout(url))
+        req.raise_for_status()
+        manifest = self.manifest_filter.apply(req.content, req.url)
+        ttl = self.dynamic_ttl if b'type="dynamic"' in req.content[:2000] else self.static_ttl
+        with self.lock:
+            self.cache = dict((k, v) for k, v in self.cache.items() if v[0] > time.time())
+            self.cache[url] = (time.time() + ttl, manifest)
+        return manifest
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ManifestRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        url = parse_qs(parts.query).get('url', [None])[0]
+        if parts.path != '/{0}/manifest.mpd'.format(self.server.token) or not url:
+            self.send_error(404)
+            return
+        try:
+            manifest = self.server.get_manifest(url)
+        except Exception as error:  # tell the player instead of dropping the connection
+            self.server.vp.log('Manifest proxy failed for %s: %s', url, error)
+            self.send_error(502)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/dash+xml')
+        self.send_header('Content-Length', str(len(manifest)))
+        self.end_headers()
+        self.wfile.write(manifest)
+
+    def log_message(self, *args):
+        pass  # requests are logged by the Viaplay library in debug mode
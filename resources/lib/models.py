@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Compact models of the Viaplay API objects
+"""
+
+
+class Product(object):
+    """A movie, series, episode, sports event or TV event, normalized by Viaplay.normalize_product."""
+    __slots__ = ('type', 'guid', 'url', 'page_url', 'flags', 'title', 'series_title', 'episode_title', 'plot',
+                 'genre', 'year', 'duration', 'cast', 'director', 'mpaa', 'rating', 'votes', 'code', 'season',
+                 'episode', 'seasons', 'format', 'art', 'start', 'end', 'start_local', 'is_today', 'status',
+                 'expired')
+
+    def __init__(self, product_type):
+        for attribute in self.__slots__:
+            setattr(self, attribute, None)
+        self.type = product_type
+
+    def __repr__(self):
+        return '<Product {0} {1!r}>'.format(self.type, self.title)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Background prefetching of the pages the user is likely to open next
+"""
+import re
+import json
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class Prefetcher(object):
+    """Collects likely-next URLs while a listing is built and warms the Viaplay
+    HTTP cache with the most likely ones once the listing has been rendered.
+    Artwork of the listing can be requested too, so the resized images are ready when the user scrolls.
+    get_vp returns the Viaplay client and is only called once something is fetched, log takes a debug message."""
+
+    def __init__(self, get_vp, log, history_file=None, max_urls=6, workers=2, max_bytes=4 * 1024 * 1024, max_images=50):
+        self.get_vp = get_vp
+        self.log = log
+        self.history_file = history_file
+        self.max_urls = max_urls
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.max_images = max_images
+        self.candidates = {}
+        self.images = []
+        self.downloaded = 0
+        self.lock = threading.Lock()
+        self._history = None
+        self.history_changed = False
+
+    @property
+    def vp(self):
+        return self.get_vp()
+
+    @property
+    def history(self):
+        """Return the number of recorded visits per URL."""
+        if self._history is None:
+            self._history = {}
+            if self.history_file:
+                try:
+                    with open(self.history_file, 'r') as history_file:
+                        self._history = json.load(history_file)
+                except (IOError, ValueError):
+                    pass
+        return self._history
+
+    @staticmethod
+    def history_key(url):
+        """Return the key of url in the history. The URL templates and the page size are left out, so a visited
+        page and the candidate for it count as the same page whatever page size the listing asks for."""
+        parts = urlsplit(re.sub(r'\{.+?\}', '', url))
+        query = [x for x in parse_qsl(parts.query) if x[0] != 'pageSize']
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    def record_visit(self, url, max_entries=500):
+        """Remember that the user opened url. The history is written by save_history."""
+        if not self.history_file:
+            return
+        url = self.history_key(url)
+        self.history[url] = self.history.get(url, 0) + 1
+        if len(self.history) > max_entries:  # forget the least visited URLs
+            self._history = dict(sorted(self.history.items(), key=lambda x: x[1], reverse=True)[:max_entries])
+        self.history_changed = True
+
+    def save_history(self):
+        """Write the history if a visit was recorded."""
+        if not self.history_changed:
+            return
+        self.history_changed = False
+        try:
+            with open(self.history_file, 'w') as history_file:
+                json.dump(self.history, history_file)
+        except IOError:
+            pass
+
+    def add(self, url, weight=1):
+        """Add a candidate URL. Higher weights are fetched first."""
+        if url and weight > self.candidates.get(url, 0):
+            self.candidates[url] = weight
+
+    def add_image(self, url):
+        """Add an artwork URL, in the order of the listing."""
+        if url and len(self.images) < self.max_images and url not in self.images:
+            self.images.append(url)
+
+    def ranked(self):
+        """Return the candidates to fetch, most likely first."""
+        urls = sorted(self.candidates,
+                      key=lambda x: self.candidates[x] * (1 + self.history.get(self.history_key(x), 0)), reverse=True)
+        return urls[:self.max_urls]
+
+    def fetch(self, url, image=False):
+        with self.lock:
+            if self.downloaded >= self.max_bytes:
+                return
+        try:
+            size = self.vp.warm_image(url) if image else self.vp.prefetch(url)
+        except Exception as error:  # a failed prefetch must never affect the listing
+            self.log('Prefetch of %s failed: %s' % (url, error))
+            return
+        with self.lock:
+            self.downloaded += size
+
+    def run(self):
+        """Fetch the candidates in the background and block until they are done."""
+        urls = self.ranked()
+        images = self.images
+        self.candidates = {}
+        self.images = []
+        if not urls and not images:
+            return
+        from concurrent.futures import ThreadPoolExecutor  # deferred, slow to import
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for url in urls:
+                executor.submit(self.fetch, url)
+            for url in images:
+                executor.submit(self.fetch, url, True)
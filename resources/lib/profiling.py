@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Per-route profiling of the plugin
+"""
+import os
+import sys
+import json
+import time
+from collections import Counter, OrderedDict
+
+# the Kodi functions and ListItem methods that are counted
+KODI_FUNCTIONS = {
+    'xbmcplugin': ('addDirectoryItem', 'addDirectoryItems', 'addSortMethod', 'setContent', 'endOfDirectory',
+                   'setResolvedUrl'),
+    'xbmcgui': ('Dialog',)
+}
+LISTITEM_METHODS = ('setArt', 'setInfo', 'setProperty', 'setSubtitles', 'setContentLookup', 'setMimeType')
+
+
+def counted(name, function, calls):
+    def wrapper(*args, **kwargs):
+        calls[name] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+class RouteProfiler(object):
+    """Measures the wall and CPU time, peak Python memory and Kodi API calls of a route and appends a summary
+    line to report_file, which keeps the last max_entries routes. With stats_dir, the route also runs under
+    cProfile and its stats are saved to stats_dir/<route>.prof for pstats or snakeviz."""
+
+    def __init__(self, report_file, stats_dir=None, max_entries=500):
+        self.report_file = report_file
+        self.stats_dir = stats_dir
+        self.max_entries = max_entries
+        self.calls = Counter()
+        self.patched = []
+        self.profile = None
+        self.started = None
+        self.cpu_started = None
+
+    def patch(self):
+        """Count the calls to the Kodi API by replacing the functions with counting ones."""
+        for module_name, names in KODI_FUNCTIONS.items():
+            module = sys.modules.get(module_name)
+            for name in names:
+                if module and hasattr(module, name):
+                    self.patched.append((module, name, getattr(module, name)))
+                    setattr(module, name, counted('%s.%s' % (module_name, name), getattr(module, name), self.calls))
+        xbmcgui = sys.modules.get('xbmcgui')
+        if xbmcgui:
+            calls = self.calls
+            list_item = xbmcgui.ListItem
+            try:
+                methods = dict((x, counted('ListItem.' + x, getattr(list_item, x), calls))
+                               for x in LISTITEM_METHODS if hasattr(list_item, x))
+                methods['__init__'] = counted('ListItem', list_item.__init__, calls)
+                counting_list_item = type('ListItem', (list_item,), methods)
+            except TypeError:  # not subclassable, only count how many are created
+                counting_list_item = counted('ListItem', list_item, calls)
+            self.patched.append((xbmcgui, 'ListItem', list_item))
+            xbmcgui.ListItem = counting_list_item
+
+    def unpatch(self):
+        for module, name, function in reversed(self.patched):
+            setattr(module, name, function)
+        self.patched = []
+
+    def start(self):
+        import tracemalloc  # deferred, only needed when profiling
+        self.patch()
+        tracemalloc.start()
+        if self.stats_dir:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.started = time.time()
+        self.cpu_started = time.process_time()
+
+    def stop(self, route, requests=0, bytes_downloaded=0):
+        """Stop measuring and record the route. Return the summary."""
+        import tracemalloc
+        wall = time.time() - self.started
+        cpu = time.process_time() - self.cpu_started
+        if self.profile:
+            self.profile.disable()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.unpatch()
+        summary = OrderedDict([
+            ('ts', round(self.started, 3)),
+            ('route', route),
+            ('wall', round(wall, 4)),
+            ('cpu', round(cpu, 4)),
+            ('peak_kib', peak // 1024),
+            ('requests', requests),
+            ('bytes', bytes_downloaded),
+            ('kodi_calls', dict(self.calls))
+        ])
+        if self.profile:
+            self.save_stats(route)
+        self.append(summary)
+        return summary
+
+    def save_stats(self, route):
+        name = route.strip('/').replace('/', '_') or 'root'
+        try:
+            self.profile.dump_stats(os.path.join(self.stats_dir, name + '.prof'))
+        except (IOError, OSError):
+            pass
+
+    def append(self, summary):
+        """Append the summary to the report, dropping the oldest entries past max_entries."""
+        try:
+            with open(self.report_file, 'a') as report:
+                report.write(json.dumps(summary) + '\n')
+            if os.path.getsize(self.report_file) > self.max_entries * 400:  # about twice the entries
+                with open(self.report_file, 'r') as report:
+                    lines = report.readlines()[-self.max_entries:]
+                tmp_file = self.report_file + '.tmp'
+                with open(tmp_file, 'w') as report:
+                    report.writelines(lines)
+                os.replace(tmp_file, self.report_file)
+        except (IOError, OSError):
+            pass
+
+
+def summarize(report_file):
+    """Summarize a report per route. Return an OrderedDict with the slowest route (by median) first."""
+    routes = {}
+    with open(report_file, 'r') as lines:
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            routes.setdefault(record['route'], []).append(record)
+    summaries = {}
+    for route, records in routes.items():
+        walls = sorted(x['wall'] for x in records)
+        summaries[route] = {
+            'count': len(records),
+            'median': walls[len(walls) // 2],
+            'max': walls[-1],
+            'cpu': sum(x['cpu'] for x in records) / len(records),
+            'peak_kib': max(x['peak_kib'] for x in records),
+            'requests': sum(x['requests'] for x in records) / float(len(records)),
+            'bytes': sum(x['bytes'] for x in records) // len(records)
+        }
+    return OrderedDict(sorted(summaries.items(), key=lambda x: x[1]['median'], reverse=True))
+
+
+if __name__ == '__main__':
+    for route_name, stats in summarize(sys.argv[1]).items():
+        print('{0}: {1} runs, median {2:.3f}s, max {3:.3f}s, cpu {4:.3f}s, peak {5} KiB, '
+              '{6:.1f} requests, {7} bytes'.format(route_name, stats['count'], stats['median'], stats['max'],
+                                                   stats['cpu'], stats['peak_kib'], stats['requests'],
+                                                   stats['bytes']))
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Local IPC between the plugin and a long-lived process holding a warm Viaplay client
+"""
+import os
+import hmac
+import json
+import pickle
+import hashlib
+import socket
+import threading
+import binascii
+import socketserver
+
+from .viaplay import Viaplay
+
+# Viaplay methods the service runs on behalf of the plugin
+REMOTE_METHODS = frozenset([
+    'get_root_page', 'get_collections', 'get_products', 'get_channels', 'get_seasons', 'make_request',
+    'get_stream', 'download_subtitles', 'get_activation_data', 'authorize_device', 'validate_session',
+    'log_out', 'prefetch', 'get_deviceid', 'search_local', 'get_all_episodes',
+    'get_product_listing', 'warm_image'
+])
+# methods that must not run twice when the service may already have run them
+UNSAFE_METHODS = frozenset(['get_activation_data', 'authorize_device', 'log_out', 'get_stream'])
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def sign(token, nonce, payload):
+    """Return the HMAC of a response, binding it to the token and the nonce of its request."""
+    return hmac.new(token.encode('ascii'), nonce.encode('ascii') + payload, hashlib.sha256).digest()
+
+
+class ServiceUnavailable(Exception):
+    """The service couldn't be reached and didn't run the call."""
+
+
+class ServiceFailed(ServiceUnavailable):
+    """The call was sent but the service stopped answering, it may have run it."""
+
+
+class ViaplayServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Serves Viaplay method calls on localhost. Requests are single JSON lines carrying a secret token and
+    a nonce, responses are pickled ('ok', result) or ('error', exception) tuples prefixed with their HMAC,
+    so the plugin never unpickles anything that didn't come from the service. While a call runs, a space is
+    sent every heartbeat seconds so the plugin can tell a busy service from a hung one."""
+    daemon_threads = True
+    allow_reuse_address = True
+    heartbeat = 2
+
+    def __init__(self, vp, info_file):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), RequestHandler)
+        self.vp = vp
+        self.info_file = info_file
+        self.token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.info = {}  # published along with the address
+
+    def publish(self):
+        """Tell the plugin where to find the service. The file is only readable by the user."""
+        tmp_file = '{0}.{1}.tmp'.format(self.info_file, os.getpid())
+        service = dict(self.info, port=self.server_address[1], token=self.token, country=self.vp.country)
+        with os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as info:
+            json.dump(service, info)
+        os.replace(tmp_file, self.info_file)
+
+    def unpublish(self):
+        try:
+            os.remove(self.info_file)
+        except OSError:
+            pass
+
+    def start(self):
+        self.publish()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.unpublish()
+        self.shutdown()
+        self.server_close()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            return
+        if (request.get('token') != self.server.token or request.get('method') not in REMOTE_METHODS or
+                not request.get('nonce')):
+            return
+        done = threading.Event()
+        write_lock = threading.Lock()
+        heartbeat = threading.Thread(target=self.send_heartbeats, args=(done, write_lock))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            result = ('ok', getattr(self.server.vp, request['method'])(*request['args'], **request['kwargs']))
+        except Exception as error:  # handed to the plugin to be raised there
+            result = ('error', error)
+        finally:
+            done.set()
+        try:
+            payload = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            payload = pickle.dumps(('error', ServiceFailed('Unpicklable result')), pickle.HIGHEST_PROTOCOL)
+        with write_lock:
+            self.wfile.write(b'\n' + sign(self.server.token, request['nonce'], payload) + payload)
+
+    def send_heartbeats(self, done, write_lock):
+        while not done.wait(self.server.heartbeat):
+            with write_lock:
+                try:
+                    self.wfile.write(b' ')
+                except socket.error:  # the plugin gave up
+                    return
+
+
+class ServiceClient(object):
+    """Calls Viaplay methods in the service. A call may take as long as the service keeps sending
+    heartbeats, timeout is how long the service may stay silent before it's considered hung."""
+
+    def __init__(self, port, token, timeout=10):
+        self.port = port
+        self.token = token
+        self.timeout = timeout
+        self.manifest_proxy = None
+        self.calls = 0
+        self.bytes = 0
+
+    @classmethod
+    def find(cls, info_file, country):
+        """Return a client for the running service or None."""
+        try:
+            with open(info_file, 'r') as info:
+                service = json.load(info)
+        except (IOError, ValueError):
+            return None
+        if service.get('country') != country:
+            return None
+        client = cls(service['port'], service['token'])
+        client.manifest_proxy = service.get('manifest_proxy')
+        return client
+
+    def call(self, method, *args, **kwargs):
+        nonce = binascii.hexlify(os.urandom(16)).decode('ascii')
+        request = json.dumps({'token': self.token, 'nonce': nonce, 'method': method, 'args': args, 'kwargs': kwargs})
+        try:
+            conn = socket.create_connection(('127.0.0.1', self.port), timeout=1)
+        except socket.error as error:
+            raise ServiceUnavailable(error)
+        try:
+            conn.settimeout(self.timeout)
+            conn.sendall(request.encode('utf-8') + b'\n')
+            response = b''.join(iter(lambda: conn.recv(65536), b''))
+        except socket.error as error:
+            raise ServiceFailed(error)
+        finally:
+            conn.close()
+        if not response:  # the service turned the request down without running it
+            raise ServiceUnavailable('Empty response')
+        self.calls += 1
+        self.bytes += len(response)
+        response = response.lstrip(b' ')  # the heartbeats
+        if not response:
+            raise ServiceFailed('Connection closed during the call')
+        if response[:1] != b'\n':
+            raise ServiceUnavailable('Unexpected response')
+        digest, payload = response[1:DIGEST_SIZE + 1], response[DIGEST_SIZE + 1:]
+        if not hmac.compare_digest(digest, sign(self.token, nonce, payload)):  # not our service, e.g. a stale port
+            raise ServiceUnavailable('Unauthenticated response')
+        try:
+            status, result = pickle.loads(payload)
+        except (pickle.UnpicklingError, AttributeError, ImportError, EOFError, ValueError) as error:
+            raise ServiceFailed(error)
+        if status == 'error':
+            raise result
+        return result
+
+
+class RemoteViaplay(object):
+    """Viaplay stand-in that runs the network methods in the service. Falls back to an
+    in-process client, created by create_local, when the service can't be reached. When the service stops
+    answering during a call, only methods that are safe to repeat fall back, the others fail."""
+    ViaplayError = Viaplay.ViaplayError
+
+    def __init__(self, service, create_local):
+        self.service = service
+        self.client = service  # kept for its statistics when the service stops answering
+        self.create_local = create_local
+        self._local = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = self.create_local()
+        return self._local
+
+    def __getattr__(self, name):
+        if name not in REMOTE_METHODS or not self.service:
+            return getattr(self.local, name)
+
+        def remote_method(*args, **kwargs):
+            if self.service:
+                try:
+                    return self.service.call(name, *args, **kwargs)
+                except ServiceFailed:
+                    self.service = None  # don't try again during this invocation
+                    if name in UNSAFE_METHODS:
+                        raise self.ViaplayError(b'ServiceUnavailableError')
+                except ServiceUnavailable:
+                    self.service = None
+            return getattr(self.local, name)(*args, **kwargs)
+        return remote_method
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Failure handling for the HTTP requests of the Viaplay library
+"""
+import time
+import random
+import threading
+
+
+class CircuitBreaker(object):
+    """Tracks consecutive failures per key (an API host). After threshold failures the circuit opens
+    and requests fail fast for reset_timeout seconds. Then a single trial request is let through,
+    closing the circuit again if it succeeds."""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = {}
+        self.opened = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """Return True if a request may be made."""
+        with self.lock:
+            opened = self.opened.get(key)
+            if opened is None:
+                return True
+            if time.time() - opened < self.reset_timeout:
+                return False
+            self.opened[key] = time.time()  # half open, let this request through and hold back the others
+            return True
+
+    def record_success(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+            self.opened.pop(key, None)
+
+    def record_failure(self, key):
+        with self.lock:
+            self.failures[key] = self.failures.get(key, 0) + 1
+            if self.failures[key] >= self.threshold:
+                self.opened[key] = time.time()
+
+
+class SingleFlight(object):
+    """Runs a function once for concurrent callers using the same key. The callers
+    arriving while it runs wait for it and get the same result or exception."""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = function()
+            return call['result']
+        except Exception as error:
+            call['error'] = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+
+
+def backoff_delay(attempt, base, cap):
+    """Return the seconds to wait before retry number attempt (starting at 1), with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def retry_after(value):
+    """Return the seconds of a Retry-After header or None when it's missing or an HTTP date."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
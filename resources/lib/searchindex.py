@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+A local full-text search index over the products the Viaplay library has seen
+"""
+import re
+import json
+import sqlite3
+import unicodedata
+
+from .sqlitestore import SqliteStore
+
+# letters NFKD doesn't decompose into a base letter
+FOLDS = {'æ': 'ae', 'ø': 'o', 'ð': 'd', 'þ': 'th', 'ß': 'ss', 'ł': 'l', 'œ': 'oe'}
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+# how much a match in a field counts
+FIELD_WEIGHTS = (('title', 3.0), ('series', 3.0), ('people', 1.0), ('genre', 0.5))
+INDEXED_TYPES = ('movie', 'series')
+
+
+def fold(text):
+    """Lower case text and strip accents and diacritics, so 'Bjørn Ålander' becomes 'bjorn alander'."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(FOLDS.get(c, c) for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(fold(text)) if text else []
+
+
+def within_one_edit(a, b):
+    """Return True if a can be turned into b with at most one insertion, deletion or substitution."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    for i in range(len(a)):
+        if a[i] != b[i]:
+            if len(a) == len(b):
+                return a[i + 1:] == b[i + 1:]
+            return a[i:] == b[i + 1:]
+    return True
+
+
+class SearchIndex(SqliteStore):
+    """An inverted index of titles, series names, people and genres stored in SQLite.
+    Products are added incrementally as they are seen and searched with prefix and
+    accent insensitive matching, falling back to one typo per word."""
+    schema = (
+        'CREATE TABLE IF NOT EXISTS products (guid TEXT PRIMARY KEY, data TEXT)',
+        'CREATE TABLE IF NOT EXISTS terms (term TEXT, guid TEXT, weight REAL, PRIMARY KEY (term, guid)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS terms_guid ON terms (guid)'
+    )
+    batch_size = 500  # older SQLite builds allow at most 999 variables per statement
+
+    @staticmethod
+    def get_fields(product):
+        content = product.get('content', {})
+        people = content.get('people', {})
+        return {
+            'title': content.get('title'),
+            'series': content.get('series', {}).get('title'),
+            'people': ' '.join(people.get('actors', []) + people.get('directors', [])),
+            'genre': ' '.join(x['title'] for x in product.get('_links', {}).get('viaplay:genres', []))
+        }
+
+    @staticmethod
+    def get_guid(product):
+        return product.get('system', {}).get('guid') or product.get('_links', {}).get('self', {}).get('href')
+
+    def select_in(self, query, keys):
+        """Run query with an IN (%s) over keys in batches below the SQLite variable limit."""
+        keys = list(keys)
+        rows = []
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i:i + self.batch_size]
+            rows.extend(self.conn.execute(query % ','.join('?' * len(batch)), batch).fetchall())
+        return rows
+
+    def add(self, products):
+        """Index the raw API products that are new or have changed since they were indexed."""
+        products = dict((self.get_guid(x), x) for x in products if x.get('type') in INDEXED_TYPES)
+        products.pop(None, None)
+        if not products:
+            return
+        try:
+            data = dict((guid, json.dumps(x, separators=(',', ':'), sort_keys=True)) for guid, x in products.items())
+            known = dict(self.select_in('SELECT guid, data FROM products WHERE guid IN (%s)', data))
+            for guid in list(products):
+                if known.get(guid) == data[guid]:
+                    del products[guid]
+            if not products:
+                return
+            terms = {}
+            for guid, product in products.items():
+                fields = self.get_fields(product)
+                for field, weight in FIELD_WEIGHTS:
+                    for token in tokenize(fields[field]):
+                        if weight > terms.get((token, guid), 0):
+                            terms[(token, guid)] = weight
+            with self.conn:
+                self.conn.execute('BEGIN')
+                # the terms of a changed product are replaced, not merged with its old ones
+                self.conn.executemany('DELETE FROM terms WHERE guid = ?', [(x,) for x in products if x in known])
+                self.conn.executemany('INSERT OR REPLACE INTO products VALUES (?, ?)',
+                                      [(guid, data[guid]) for guid in products])
+                self.conn.executemany('INSERT OR REPLACE INTO terms VALUES (?, ?, ?)',
+                                      [(term, guid, weight) for (term, guid), weight in terms.items()])
+        except sqlite3.Error:
+            pass
+
+    def match(self, token):
+        """Return the score per product for a single query word."""
+        matches = {}
+        rows = self.conn.execute('SELECT term, guid, weight FROM terms WHERE term >= ? AND term < ?',
+                                 (token, token + '\uffff'))
+        for term, guid, weight in rows:
+            score = weight if term == token else weight * 0.7  # exact words rank above prefixes
+            if score > matches.get(guid, 0):
+                matches[guid] = score
+        if not matches and len(token) >= 4:  # allow a typo in longer words
+            rows = self.conn.execute('SELECT term, guid, weight FROM terms WHERE term >= ? AND term < ?',
+                                     (token[:2], token[:2] + '\uffff'))
+            for term, guid, weight in rows:
+                if within_one_edit(term, token) and weight * 0.4 > matches.get(guid, 0):
+                    matches[guid] = weight * 0.4
+        return matches
+
+    def search(self, query, limit=50):
+        """Return the raw products matching all words of query, best match first."""
+        scores = None
+        try:
+            for token in tokenize(query):
+                matches = self.match(token)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = dict((guid, scores[guid] + score) for guid, score in matches.items() if guid in scores)
+                if not scores:
+                    return []
+            if not scores:
+                return []
+            ranked = sorted(scores, key=lambda x: scores[x], reverse=True)[:limit]
+            rows = self.select_in('SELECT guid, data FROM products WHERE guid IN (%s)', ranked)
+        except sqlite3.Error:
+            return []
+        data = dict(rows)
+        return [json.loads(data[guid]) for guid in ranked if guid in data]
+
+    def clear(self):
+        try:
+            self.conn.executescript('DELETE FROM products; DELETE FROM terms;')
+        except sqlite3.Error:
+            pass
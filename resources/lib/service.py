@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+A Kodi service keeping a warm Viaplay client for the plugin
+"""
+import os
+
+from .kodihelper import KodiHelper
+from .remote import ViaplayServer
+from .manifest import ManifestFilter, ManifestProxy
+
+import xbmc
+
+
+class ViaplayMonitor(xbmc.Monitor):
+    def __init__(self, service):
+        xbmc.Monitor.__init__(self)
+        self.service = service
+
+    def onSettingsChanged(self):
+        self.service.restart()
+
+
+class ViaplayService(object):
+    # settings of the manifest proxy, in the order of the setting values
+    max_heights = (0, 2160, 1080, 720, 576)
+    codecs = (None, ('avc1', 'avc3'), ('hev1', 'hvc1'))
+
+    def __init__(self):
+        self.server = None
+        self.manifest_proxy = None
+        self.helper = None
+
+    def start(self):
+        self.helper = KodiHelper()
+        if not self.helper.get_setting('use_service'):
+            return
+        info_file = os.path.join(self.helper.addon_profile, 'service.json')
+        self.server = ViaplayServer(self.helper.create_viaplay(), info_file)
+        if self.helper.get_setting('manifest_proxy'):
+            self.start_manifest_proxy()
+        self.server.start()
+        self.helper.log('Service listening on port %s' % self.server.server_address[1])
+
+    def start_manifest_proxy(self):
+        helper = self.helper
+        manifest_filter = ManifestFilter(
+            max_height=self.max_heights[int(helper.get_setting('max_resolution') or 0)],
+            max_bandwidth=int(helper.get_setting('max_bitrate') or 0) * 1000,
+            codec=self.codecs[int(helper.get_setting('preferred_codec') or 0)],
+            languages=helper.preferred_languages() if helper.get_setting('filter_languages') else None)
+        self.manifest_proxy = ManifestProxy(self.server.vp, manifest_filter, self.server.token)
+        self.manifest_proxy.start()
+        self.server.info['manifest_proxy'] = self.manifest_proxy.url
+
+    def stop(self):
+        if self.manifest_proxy:
+            self.manifest_proxy.stop()
+            self.manifest_proxy = None
+        if self.server:
+            self.server.stop()
+            self.server = None
+
+    def restart(self):
+        """Settings like the country affect the client, start over with a new one."""
+        self.stop()
+        self.start()
+
+    def run(self):
+        monitor = ViaplayMonitor(self)
+        self.start()
+        monitor.waitForAbort()
+        self.stop()
+
+
+def run():
+    ViaplayService().run()
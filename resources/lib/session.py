@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent session state (cookies and device ID) for the Viaplay library
+"""
+import os
+import uuid
+import atexit
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, rely on atomic replaces only
+    fcntl = None
+
+
+class SessionState(object):
+    """Loads the cookie jar and device ID once per process and only writes them back
+    when they have changed. Writes are atomic and serialized between processes with a lock file.
+    Only the cookies this process changed are written, on top of what the other processes saved."""
+
+    def __init__(self, settings_folder):
+        self.cookie_file = os.path.join(settings_folder, 'cookie_file')
+        self.deviceid_file = os.path.join(settings_folder, 'deviceId')
+        self.lock_file = os.path.join(settings_folder, 'session.lock')
+        import http.cookiejar as cookielib  # deferred, slow to import
+        self.cookielib = cookielib
+        self.cookie_jar = cookielib.LWPCookieJar(self.cookie_file)
+        self.device_id = None
+        self.save_lock = threading.Lock()  # the client may be used from several threads
+        with self.lock(shared=True):
+            try:
+                self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
+            except IOError:
+                pass
+        self.saved_state = self.cookie_state()
+        atexit.register(self.save)
+
+    @contextmanager
+    def lock(self, shared=False):
+        """Hold an inter-process lock on the session files."""
+        if not fcntl:
+            yield
+            return
+        with open(self.lock_file, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def cookie_state(self):
+        return sorted((c.domain, c.path, c.name, c.value, c.expires) for c in self.cookie_jar)
+
+    def is_dirty(self):
+        return self.cookie_state() != self.saved_state
+
+    def save(self):
+        """Write the cookies that changed since they were loaded or last saved. The cookie file is
+        read again under the lock, so the cookies other processes saved in the meantime are kept."""
+        with self.save_lock:
+            state = self.cookie_state()
+            if state == self.saved_state:
+                return False
+            saved = dict(((x[0], x[1], x[2]), x) for x in self.saved_state)
+            current = dict(((x[0], x[1], x[2]), x) for x in state)
+            tmp_file = '{0}.{1}.tmp'.format(self.cookie_file, os.getpid())
+            with self.lock():
+                disk_jar = self.cookielib.LWPCookieJar(self.cookie_file)
+                try:
+                    disk_jar.load(ignore_discard=True, ignore_expires=True)
+                except IOError:
+                    pass
+                for cookie in list(self.cookie_jar):
+                    key = (cookie.domain, cookie.path, cookie.name)
+                    if saved.get(key) != current[key]:
+                        disk_jar.set_cookie(cookie)
+                for key in saved:
+                    if key not in current:  # removed by this process
+                        try:
+                            disk_jar.clear(*key)
+                        except KeyError:
+                            pass
+                disk_jar.save(tmp_file, ignore_discard=True, ignore_expires=False)
+                os.replace(tmp_file, self.cookie_file)
+            self.cookie_jar.clear()  # continue with what the other processes saved too
+            for cookie in disk_jar:
+                self.cookie_jar.set_cookie(cookie)
+            self.saved_state = self.cookie_state()
+            return True
+
+    def get_device_id(self):
+        """Return the device ID (generated UUID4), creating and storing it on first use."""
+        if self.device_id:
+            return self.device_id
+        try:
+            with open(self.deviceid_file, 'r') as deviceid:
+                self.device_id = deviceid.read()
+        except IOError:
+            with self.lock():
+                if os.path.exists(self.deviceid_file):  # another process was faster
+                    with open(self.deviceid_file, 'r') as deviceid:
+                        self.device_id = deviceid.read()
+                else:
+                    self.device_id = str(uuid.uuid4())
+                    tmp_file = '{0}.{1}.tmp'.format(self.deviceid_file, os.getpid())
+                    with open(tmp_file, 'w') as idfile:
+                        idfile.write(self.device_id)
+                    os.replace(tmp_file, self.deviceid_file)
+
+        return self.device_id
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+The SQLite connection handling shared by the local stores
+"""
+import os
+import sqlite3
+import threading
+
+
+class SqliteStore(object):
+    """Base of the SQLite backed stores. The database runs in WAL mode so that several plugin
+    processes can read and write it at the same time. schema holds the statements creating
+    the tables of the store, they are run when a connection is opened."""
+    schema = ()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()  # sqlite connections can't be shared between threads
+
+    @property
+    def conn(self):
+        """Open the database on first use in each thread."""
+        if getattr(self.local, 'conn', None) is None:
+            directory = os.path.dirname(self.db_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                conn.execute(statement)
+            self.local.conn = conn
+        return self.local.conn
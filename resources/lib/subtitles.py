@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+SAMI subtitle conversion and a disk cache for the converted subtitles
+"""
+import os
+import re
+import time
+import codecs
+import sqlite3
+import hashlib
+import threading
+from html.parser import HTMLParser
+
+from .sqlitestore import SqliteStore
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+ITALIC_PATTERN = re.compile(r'</?i>')
+
+
+def format_time(milliseconds, subtitle_format):
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    separator = '.' if subtitle_format == 'vtt' else ','
+    return '{0:02d}:{1:02d}:{2:02d}{3}{4:03d}'.format(hours, minutes, seconds, separator, milliseconds)
+
+
+class SamiConverter(HTMLParser):
+    """Converts SAMI to SRT or WebVTT while it's fed. A cue is written to output as soon as
+    the next SYNC element tells when it ends. HTML entities are decoded by the parser."""
+    last_cue_duration = 4000  # milliseconds, the last cue has no end
+
+    def __init__(self, output, subtitle_format='srt'):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.output = output
+        self.format = subtitle_format
+        self.start = None
+        self.lines = ['']
+        self.cues = 0
+        if subtitle_format == 'vtt':
+            output.write('WEBVTT\n\n')
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'sync':
+            try:
+                start = int(dict(attrs).get('start'))
+            except (TypeError, ValueError):
+                return
+            self.write_cue(start)
+            self.start = start
+            self.lines = ['']
+        elif tag == 'br' or (tag == 'p' and self.lines[-1].strip()):
+            self.lines.append('')
+        elif tag == 'i' and self.start is not None:
+            self.lines[-1] += '<i>'
+
+    def handle_endtag(self, tag):
+        if tag == 'i' and self.start is not None:
+            self.lines[-1] += '</i>'
+
+    def handle_data(self, data):
+        if self.start is not None:
+            self.lines[-1] += WHITESPACE_PATTERN.sub(' ', data)
+
+    def write_cue(self, end):
+        """Write the current cue, if it has any text. Empty cues only clear the screen."""
+        if self.start is None:
+            return
+        text = '\n'.join(x.strip() for x in self.lines if ITALIC_PATTERN.sub('', x).strip())
+        if not text:
+            return
+        self.cues += 1
+        if self.format != 'vtt':
+            self.output.write('{0}\n'.format(self.cues))
+        self.output.write('{0} --> {1}\n{2}\n\n'.format(
+            format_time(self.start, self.format), format_time(max(end, self.start), self.format), text))
+
+    def close(self):
+        HTMLParser.close(self)
+        if self.start is not None:
+            self.write_cue(self.start + self.last_cue_duration)
+            self.start = None
+
+
+class SubtitleCache(SqliteStore):
+    """Converted subtitles stored in cache_dir as <content hash>.<language>.<format>, so Kodi can
+    tell their language from the file name. The subtitle URLs are mapped to the files in an SQLite
+    database and the least recently used files are removed when the cache grows past max_size."""
+
+    schema = ('CREATE TABLE IF NOT EXISTS subtitles (url TEXT PRIMARY KEY, file TEXT, size INTEGER, accessed REAL)',)
+
+    def __init__(self, cache_dir, max_size=10 * 1024 * 1024):
+        SqliteStore.__init__(self, os.path.join(cache_dir, 'subtitles.db'))
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def get(self, url, subtitle_format):
+        """Return the path of the cached subtitle of url or None."""
+        try:
+            row = self.conn.execute('SELECT file FROM subtitles WHERE url = ?', (url,)).fetchone()
+            if not row or not row[0].endswith('.' + subtitle_format):
+                return None
+            path = os.path.join(self.cache_dir, row[0])
+            if not os.path.exists(path):
+                return None
+            self.conn.execute('UPDATE subtitles SET accessed = ? WHERE url = ?', (time.time(), url))
+        except sqlite3.Error:
+            return None
+        return path
+
+    def add(self, url, language, chunks, subtitle_format='srt'):
+        """Convert the SAMI subtitle read from chunks (an iterable of bytes) and store it.
+        Return the path of the converted subtitle."""
+        tmp_path = os.path.join(self.cache_dir, '{0}.{1}.tmp'.format(os.getpid(), threading.current_thread().ident))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        digest = hashlib.sha1()
+        decoder = codecs.getincrementaldecoder('utf-8')('ignore')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as output:
+                converter = SamiConverter(output, subtitle_format)
+                for chunk in chunks:
+                    digest.update(chunk)
+                    converter.feed(decoder.decode(chunk))
+                converter.feed(decoder.decode(b'', final=True))
+                converter.close()
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        file_name = '{0}.{1}.{2}'.format(digest.hexdigest(), language, subtitle_format)
+        path = os.path.join(self.cache_dir, file_name)
+        os.replace(tmp_path, path)  # the same content is the same file
+        try:
+            self.conn.execute('INSERT OR REPLACE INTO subtitles VALUES (?, ?, ?, ?)',
+                              (url, file_name, os.path.getsize(path), time.time()))
+            self.evict()
+        except sqlite3.Error:
+            pass
+        return path
+
+    def evict(self):
+        """Remove the least recently used subtitles until the cache is within max_size."""
+        total = self.conn.execute('SELECT SUM(size) FROM subtitles').fetchone()[0] or 0
+        if total <= self.max_size:
+            return
+        for url, file_name, size in self.conn.execute('SELECT url, file, size FROM subtitles '
+                                                      'ORDER BY accessed').fetchall():
+            if total <= self.max_size * 0.9:
+                break
+            self.conn.execute('DELETE FROM subtitles WHERE url = ?', (url,))
+            total -= size
+            if not self.conn.execute('SELECT 1 FROM subtitles WHERE file = ?', (file_name,)).fetchone():
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
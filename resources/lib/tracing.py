@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Request tracing for the Viaplay library
+"""
+import sys
+import json
+import time
+import random
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Tracer(object):
+    """Records timings of the HTTP requests made by the Viaplay library.
+    Records are appended to a JSON lines file when a trace file is set."""
+
+    def __init__(self, trace_file=None, sample_rate=1.0):
+        self.trace_file = trace_file
+        self.sample_rate = sample_rate
+        self.route = None
+        self.requests = 0  # requests that went to the network and their size, traced or not
+        self.bytes = 0
+
+    def start(self, url, method):
+        """Return a new trace record. The caller fills in the timings."""
+        return {
+            'ts': time.time(),
+            'route': self.route,
+            'method': method,
+            'url': url,
+            'status': None,
+            'bytes': 0,
+            'cache': 'bypass'
+        }
+
+    def finish(self, record):
+        """Stamp the total time of the request and write the record to the trace file."""
+        if 'url' in record and record.get('cache') != 'hit':  # phase timings have neither
+            self.requests += 1
+            self.bytes += record['bytes']
+        if not self.trace_file or random.random() >= self.sample_rate:
+            return
+        record['total'] = round(time.time() - record['ts'], 4)
+        try:
+            with open(self.trace_file, 'a') as trace_file:
+                trace_file.write(json.dumps(record) + '\n')
+        except IOError:
+            pass
+
+
+class PhaseTimer(object):
+    """Measures the phases of an operation, like starting playback. Phases may run concurrently."""
+
+    def __init__(self, name):
+        self.record = {'ts': time.time(), 'name': name, 'phases': OrderedDict()}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record['phases'][name] = round(time.time() - start, 4)
+
+    def mark(self, name):
+        """Record the time from the start of the operation until now as phase name."""
+        self.record['phases'][name] = round(time.time() - self.record['ts'], 4)
+
+    def summary(self):
+        return '{0}: {1}'.format(self.record['name'], ', '.join(
+            '{0} {1:.0f} ms'.format(name, seconds * 1000) for name, seconds in self.record['phases'].items()))
+
+
+def summarize(trace_file):
+    """Summarize a trace file per route. Return an OrderedDict with the slowest route first."""
+    routes = {}
+    with open(trace_file, 'r') as lines:
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            route = routes.setdefault(record.get('route') or record['url'],
+                                      {'requests': 0, 'total': 0.0, 'network': 0.0, 'parse': 0.0, 'bytes': 0,
+                                       'cache': {}})
+            route['requests'] += 1
+            route['total'] += record.get('total', 0)
+            route['network'] += record.get('ttfb', 0) + record.get('download', 0)
+            route['parse'] += record.get('parse', 0)
+            route['bytes'] += record.get('bytes', 0)
+            route['cache'][record['cache']] = route['cache'].get(record['cache'], 0) + 1
+
+    return OrderedDict(sorted(routes.items(), key=lambda x: x[1]['total'], reverse=True))
+
+
+if __name__ == '__main__':
+    for route_name, stats in summarize(sys.argv[1]).items():
+        print('{0}: {1} requests, {2:.3f}s total ({3:.3f}s network, {4:.3f}s parse), {5} bytes, cache {6}'.format(
+            route_name, stats['requests'], stats['total'], stats['network'], stats['parse'], stats['bytes'],
+            stats['cache']))
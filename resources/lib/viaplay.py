@@ -3,38 +3,94 @@
 A Kodi-agnostic library for Viaplay
 """
 import os
-import http.cookiejar as cookielib
 import calendar
 import re
 import json
-import uuid
-import html.parser as HTMLParser
-from collections import OrderedDict
+import time
+import itertools
 from datetime import datetime, timedelta
-
-import iso8601
-import requests
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .cache import HttpCache
+from .session import SessionState
+from .tracing import Tracer
+from .models import Product
+from .epg import EpgIndex
+from .epgstore import EpgStore
+from .searchindex import SearchIndex
+from .subtitles import SubtitleCache
+from .jsonstream import extract, iter_chunks
+from .artwork import ArtworkResolver
+from .resilience import CircuitBreaker, SingleFlight, backoff_delay, retry_after
+
+try:  # use the fastest available JSON decoder
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        json_loads = json.loads
 
 
 class Viaplay(object):
-    def __init__(self, settings_folder, country, debug=False):
+    # cache lifetime (in seconds) of content pages, first matching pattern wins
+    cache_ttls = [
+        (r'/(starred|watched|purchased|continue)', 0),  # personal lists, always fetch
+        (r'/(channels|kanaler|kanavat|tve)', 60),
+        (r'/(sport|urheilu)', 120),
+        (r'/(categoryFilters|sortings)', 3600)
+    ]
+    default_cache_ttl = 600
+    # (connect, read) timeouts in seconds, first matching pattern wins
+    timeouts = [
+        (r'^https://content\.', (3.05, 15)),
+        (r'^https://(login|play)\.', (3.05, 20)),
+    ]
+    default_timeout = (5, 30)  # subtitles and other CDN files
+    max_retries = 2  # for idempotent requests
+    retry_statuses = (429, 500, 502, 503, 504)
+    retry_backoff = 0.5  # base of the exponential backoff in seconds
+    max_retry_wait = 8  # longer Retry-After waits are not worth blocking the UI for
+    subtitle_format = 'srt'  # or 'vtt'
+    # the parts of the big pages that are used, only these are read from the responses in low memory mode
+    page_paths = {
+        'channels': ('type', '_embedded.viaplay:blocks[*].{type,_links}',
+                     '_embedded.viaplay:blocks[0]._embedded.viaplay:blocks[*].viaplay:channel'),
+        'collections': ('_embedded.viaplay:blocks[*].{type,title,totalProductCount,_links}',),
+        'seasons': ('_embedded.viaplay:blocks[*].{type,title,_links}',)
+    }
+    log_body_limit = 1000  # number of response bytes to print when debugging
+    stream_chunk_size = 64 * 1024  # bytes read at a time from streamed responses in low memory mode
+    json_loads = staticmethod(json_loads)  # may be replaced with any json.loads compatible function
+
+    def __init__(self, settings_folder, country, debug=False, trace=False, search_index=False,
+                 artwork_quality='high', low_memory=False):
         self.debug = debug
+        self.low_memory = low_memory
         self.country = country
         self.settings_folder = settings_folder
-        self.cookie_jar = cookielib.LWPCookieJar(os.path.join(self.settings_folder, 'cookie_file'))
-        self.tempdir = os.path.join(settings_folder, 'tmp')
-        if not os.path.exists(self.tempdir):
-            os.makedirs(self.tempdir)
-        self.deviceid_file = os.path.join(settings_folder, 'deviceId')
+        if not os.path.exists(self.settings_folder):
+            os.makedirs(self.settings_folder)
+        self.session = SessionState(self.settings_folder)
+        self.cookie_jar = self.session.cookie_jar
+        import requests  # deferred, importing requests is a big part of the start-up time
         self.http_session = requests.Session()
+        self.request_error = requests.RequestException
+        self.circuit_breaker = CircuitBreaker()
+        self.single_flight = SingleFlight()
         self.device_key = 'xdk-%s' % self.country
         self.base_url = 'https://content.viaplay.{0}/{1}'.format(self.country, self.device_key)
         self.login_api = 'https://login.viaplay.%s/api' % self.country
-        try:
-            self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
-        except IOError:
-            pass
         self.http_session.cookies = self.cookie_jar
+        self.cache = HttpCache(os.path.join(self.settings_folder, 'http_cache.db'))
+        self.epg_store = EpgStore(os.path.join(self.settings_folder, 'epg_%s.db' % self.country))
+        if search_index:
+            self.search_index = SearchIndex(os.path.join(self.settings_folder, 'search_%s.db' % self.country))
+        else:
+            self.search_index = None
+        self.artwork = ArtworkResolver(artwork_quality)
+        self.subtitle_cache = SubtitleCache(os.path.join(self.settings_folder, 'subtitles'))
+        self.tracer = Tracer(os.path.join(self.settings_folder, 'trace.jsonl') if trace else None)
 
     class ViaplayError(Exception):
         def __init__(self, value):
@@ -43,9 +99,10 @@ class Viaplay(object):
         def __str__(self):
             return repr(self.value)
 
-    def log(self, string):
+    def log(self, string, *args):
+        """Print a debug message. Arguments are only formatted into the message when debugging is enabled."""
         if self.debug:
-            print('[Viaplay]: %s' % string)
+            print('[Viaplay]: %s' % (string % args if args else string))
 
     def parse_url(self, url):
         """Sometimes, Viaplay adds some weird templated stuff to the URL
@@ -53,46 +110,262 @@ class Viaplay(object):
         template = r'\{.+?\}'
         result = re.search(template, url)
         if result:
-            self.log('Unparsed URL: {0}'.format(url))
+            self.log('Unparsed URL: %s', url)
             url = re.sub(template, '', url)
 
         return url
 
-    def make_request(self, url, method, params=None, payload=None, headers=None):
-        """Make an HTTP request. Return the response."""
+    @classmethod
+    def get_cache_ttl(cls, url):
+        """Return how many seconds a response from url may be cached. Only content pages are cached."""
+        if not url.startswith('https://content.viaplay.'):
+            return 0
+        for pattern, ttl in cls.cache_ttls:
+            if re.search(pattern, url):
+                return ttl
+
+        return cls.default_cache_ttl
+
+    def get_page_paths(self, page_type):
+        """Return the paths to read from a big page in low memory mode, or None to read all of it."""
+        return self.page_paths[page_type] if self.low_memory else None
+
+    def get_timeout(self, url):
+        """Return the (connect, read) timeout for requests to url."""
+        for pattern, timeout in self.timeouts:
+            if re.search(pattern, url):
+                return timeout
+
+        return self.default_timeout
+
+    def make_request(self, url, method, params=None, payload=None, headers=None, paths=None):
+        """Make an HTTP request. Return the response.
+        With paths, only the values at those paths are read from a JSON response, see jsonstream.extract."""
         url = self.parse_url(url)
-        self.log('Request URL: %s' % url)
-        self.log('Method: %s' % method)
+        self.log('Request URL: %s', url)
+        self.log('Method: %s', method)
         if params:
-            self.log('Params: %s' % params)
+            self.log('Params: %s', params)
         if payload:
-            self.log('Payload: %s' % payload)
+            self.log('Payload: %s', payload)
         if headers:
-            self.log('Headers: %s' % headers)
+            self.log('Headers: %s', headers)
+
+        trace = self.tracer.start(url, method)
+        try:
+            return self.send_request(url, method, params, payload, headers, trace, paths)
+        finally:
+            self.tracer.finish(trace)
+
+    def send_request(self, url, method, params, payload, headers, trace, paths=None):
+        """Serve the request from the cache or the network, recording timings in trace.
+        With paths (low memory mode), JSON bodies are parsed while they stream in and never held whole."""
+        cache_key = None
+        cached = None
+        stream = bool(paths) and method == 'get'
+        ttl = self.get_cache_ttl(url) if method == 'get' else 0
+        if ttl:
+            cache_key = self.cache.make_key(url, params)
+            cached = self.cache.get(cache_key, body=not stream)
+            trace['cache'] = 'miss'
+            if cached:
+                if cached['expires'] > time.time():
+                    self.log('Cache hit: %s', cache_key)
+                    trace['cache'] = 'hit'
+                    trace['bytes'] = cached['size']
+                    return self.timed_parse(self.cached_body(cache_key, cached), trace, paths=paths)
+                # revalidate the stale entry
+                headers = dict(headers) if headers else {}
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+        if method == 'get' and not stream:  # identical concurrent requests share one response
+            flight_key = (self.cache.make_key(url, params), tuple(sorted(headers.items())) if headers else ())
+            status, response_headers, content = self.single_flight.do(
+                flight_key, lambda: self.fetch(url, method, params, payload, headers, trace))
+        else:  # a streamed body can only be read by one caller
+            status, response_headers, content = self.fetch(url, method, params, payload, headers, trace, stream)
+        trace['status'] = status
+        self.log('Response code: %s', status)
+        self.session.save()  # only written when the cookies have changed
+        if not isinstance(content, bytes):
+            return self.parse_stream(content, trace, response_headers, cache_key, ttl, paths)
+        trace['bytes'] = len(content)
+
+        if cached and status == 304:
+            self.log('Cache revalidated: %s', cache_key)
+            trace['cache'] = 'revalidated'
+            self.cache.touch(cache_key, ttl)
+            return self.timed_parse(self.cached_body(cache_key, cached), trace, paths=paths)
+
+        if self.debug:
+            self.log('Response (%s bytes): %s', len(content), content[:self.log_body_limit])
+        response = self.timed_parse(content, trace, response_headers.get('Content-Type'), paths)
+        if cache_key and status == 200:
+            self.cache.set(cache_key, content, ttl, etag=response_headers.get('ETag'),
+                           last_modified=response_headers.get('Last-Modified'))
 
+        return response
+
+    def cached_body(self, cache_key, cached):
+        """Return the body of a cache entry, or an iterator over its chunks when it was read without it."""
+        return cached['body'] if 'body' in cached else self.cache.iter_body(cache_key, self.stream_chunk_size)
+
+    def parse_stream(self, chunks, trace, response_headers, cache_key, ttl, paths):
+        """Parse a streamed JSON body. The chunks are copied to a spool file for the cache as they arrive."""
+        spool = None
+        if cache_key:
+            import tempfile  # deferred, only needed in low memory mode
+            spool = tempfile.TemporaryFile()
+
+        def tee():
+            for chunk in chunks:
+                trace['bytes'] += len(chunk)
+                if spool:
+                    spool.write(chunk)
+                yield chunk
+
+        body = tee()
+        try:
+            response = self.timed_parse(body, trace, response_headers.get('Content-Type'), paths)
+            for _ in body:  # read to the end so the cached copy is complete
+                pass
+            if spool:
+                self.cache.set_file(cache_key, spool, trace['bytes'], ttl, etag=response_headers.get('ETag'),
+                                    last_modified=response_headers.get('Last-Modified'))
+        except self.request_error as error:  # the connection broke while streaming
+            raise self.ViaplayError(b'ServiceUnavailableError') from error
+        finally:
+            if spool:
+                spool.close()
+
+        return response
+
+    def fetch(self, url, method, params, payload, headers, trace, stream=False):
+        """Send the request to the network. GET requests are retried with backoff on connection errors,
+        timeouts and temporary server errors. Hosts that keep failing are not contacted until the circuit
+        breaker lets a trial request through. Return the status code, headers and body.
+        With stream, the body of a successful JSON response is an iterator over its chunks."""
+        host = urlsplit(url).netloc
+        if not self.circuit_breaker.allow(host):
+            self.log('Circuit open, not requesting %s', url)
+            raise self.ViaplayError(b'ServiceUnavailableError')
+        attempts = self.max_retries + 1 if method == 'get' else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                status, response_headers, content = self.send(url, method, params, payload, headers, trace, stream)
+            except self.request_error as error:
+                self.log('Request failed (attempt %s): %s', attempt, error)
+                self.circuit_breaker.record_failure(host)
+                if attempt == attempts or not self.circuit_breaker.allow(host):
+                    raise self.ViaplayError(b'ServiceUnavailableError') from error
+                delay = None
+            else:
+                if status >= 500:
+                    self.circuit_breaker.record_failure(host)
+                else:
+                    self.circuit_breaker.record_success(host)
+                if status not in self.retry_statuses or attempt == attempts:
+                    return status, response_headers, content
+                delay = retry_after(response_headers.get('Retry-After')) if status == 429 else None
+                if delay is not None and delay > self.max_retry_wait:
+                    return status, response_headers, content
+                self.log('Response code %s (attempt %s), retrying', status, attempt)
+            if delay is None:
+                delay = backoff_delay(attempt, self.retry_backoff, self.max_retry_wait)
+            trace['retries'] = attempt
+            time.sleep(delay)
+
+    def send(self, url, method, params, payload, headers, trace, stream=False):
+        """Make a single HTTP request. Return the status code, headers and body.
+        With stream, the body of a successful JSON response is returned unread, as an iterator over its chunks."""
+        # stream the body so time to first byte and download time can be told apart
+        timeout = self.get_timeout(url)
         if method == 'get':
-            req = self.http_session.get(url, params=params, headers=headers)
+            req = self.http_session.get(url, params=params, headers=headers, stream=True, timeout=timeout)
         elif method == 'put':
-            req = self.http_session.put(url, params=params, data=payload, headers=headers)
+            req = self.http_session.put(url, params=params, data=payload, headers=headers, stream=True,
+                                        timeout=timeout)
         else:  # post
-            req = self.http_session.post(url, params=params, data=payload, headers=headers)
-        self.log('Response code: %s' % req.status_code)
-        self.log('Response: %s' % req.content)
-        self.cookie_jar.save(ignore_discard=True, ignore_expires=False)
+            req = self.http_session.post(url, params=params, data=payload, headers=headers, stream=True,
+                                         timeout=timeout)
+        trace['ttfb'] = req.elapsed.total_seconds()
+        if stream and req.status_code == 200 and 'json' in req.headers.get('Content-Type', ''):
+            trace['streamed'] = True  # the download is part of the parse time
+            return req.status_code, req.headers, req.iter_content(self.stream_chunk_size)
+        download_start = time.time()
+        content = req.content
+        trace['download'] = round(time.time() - download_start, 4)
+
+        return req.status_code, req.headers, content
+
+    def warm_image(self, url):
+        """Request an image so the image service resizes and caches it. Return the number of bytes."""
+        req = self.http_session.get(url, stream=True, timeout=self.get_timeout(url))
+        return len(req.content)
+
+    def prefetch(self, url):
+        """Warm the cache with a content page. Return the number of bytes downloaded."""
+        url = self.parse_url(url)
+        if not self.get_cache_ttl(url):
+            return 0
+        cached = self.cache.get(self.cache.make_key(url))
+        if cached and cached['expires'] > time.time():
+            return 0
+
+        trace = self.tracer.start(url, 'get')
+        trace['prefetch'] = True
+        try:
+            self.send_request(url, 'get', None, None, None, trace)
+        finally:
+            self.tracer.finish(trace)
 
-        return self.parse_response(req.content)
+        return trace['bytes']
 
-    def parse_response(self, response):
-        """Try to load JSON data into dict and raise potential errors."""
+    def timed_parse(self, content, trace, content_type=None, paths=None):
+        parse_start = time.time()
+        try:
+            return self.parse_response(content, content_type, paths)
+        finally:
+            trace['parse'] = round(time.time() - parse_start, 4)
+
+    def parse_response(self, response, content_type=None, paths=None):
+        """Load JSON data into dict and raise potential errors. Other responses are returned as is.
+        Without a content type, the first character of the response tells if it's JSON.
+        With paths, only the values at those paths (and the error fields) are loaded. The response may then
+        be an iterator over the chunks of the body, which is read as it's parsed."""
+        if isinstance(response, bytes):
+            head = response
+        else:
+            chunks = iter(response)
+            head = next(chunks, b'')
+            response = itertools.chain([head], chunks)
+        if content_type:
+            if 'json' not in content_type:
+                return self.join_body(response)
+        elif head[:64].lstrip()[:1] not in (b'{', b'['):
+            return self.join_body(response)
         try:
-            response = json.loads(response, object_pairs_hook=OrderedDict)  # keep the key order
-            if 'success' in response and not response['success']:  # raise ViaplayError when 'success' is False
-                raise self.ViaplayError(response['name'].encode('utf-8'))
-        except ValueError:  # if response is not json
-            pass
+            if paths:
+                chunks = iter_chunks(response) if isinstance(response, bytes) else response
+                response = extract(chunks, tuple(paths) + ('success', 'name'), self.json_loads)
+            else:
+                response = self.json_loads(self.join_body(response))
+        except ValueError:  # if response is not json after all
+            if not isinstance(response, bytes):
+                raise
+            return response
+        if 'success' in response and not response['success']:  # raise ViaplayError when 'success' is False
+            raise self.ViaplayError(response['name'].encode('utf-8'))
 
         return response
 
+    @staticmethod
+    def join_body(response):
+        return response if isinstance(response, bytes) else b''.join(response)
+
     def get_activation_data(self):
         """Get activation data (reg code etc) needed to authorize the device."""
         url = self.login_api + '/device/code'
@@ -114,6 +387,7 @@ class Viaplay(object):
 
         self.make_request(url=url, method='get', params=params)
         self.validate_session()  # we need this to validate the new cookies
+        self.clear_account_data()  # it belongs to the previous session
         return True
 
     def validate_session(self):
@@ -132,8 +406,21 @@ class Viaplay(object):
             'deviceKey': self.device_key
         }
         self.make_request(url=url, method='get', params=params)
+        self.clear_account_data()
         return True
 
+    def clear_account_data(self):
+        """Forget the pages, schedules and products seen with the current subscription.
+        The search index is cleared even when local search is off, so it doesn't come back stale."""
+        self.cache.clear()
+        self.epg_store.clear()
+        search_index = self.search_index
+        search_db = os.path.join(self.settings_folder, 'search_%s.db' % self.country)
+        if not search_index and os.path.exists(search_db):
+            search_index = SearchIndex(search_db)
+        if search_index:
+            search_index.clear()
+
     def get_stream(self, guid, pincode=None, tve='false'):
         """Return a dict with the stream URL:s and available subtitle URL:s."""
         stream = {}
@@ -198,12 +485,14 @@ class Viaplay(object):
 
     def get_collections(self, url):
         """Return all available collections."""
-        data = self.make_request(url=url, method='get')
+        data = self.make_request(url=url, method='get', paths=self.get_page_paths('collections'))
         # return all blocks (collections) with 'list' in type
-        return [x for x in data['_embedded']['viaplay:blocks'] if 'list' in x['type'].lower()]
+        # extract leaves out empty containers
+        return [x for x in data.get('_embedded', {}).get('viaplay:blocks', []) if 'list' in x['type'].lower()]
 
-    def get_products(self, url, filter_event=False, search_query=None):
-        """Return a dict containing the products and next page if available."""
+    def get_products(self, url, filter_event=False, search_query=None, normalize=True):
+        """Return a dict containing the products and next page if available.
+        The products are Product objects unless normalize is False, then they are the raw API dicts."""
         if search_query:
             params = {'query': search_query}
         else:
@@ -222,9 +511,17 @@ class Viaplay(object):
             # try to collect all products found in viaplay:blocks
             products = [p for x in data['_embedded']['viaplay:blocks'] if 'viaplay:products' in x['_embedded'] for p in x['_embedded']['viaplay:products']]
 
+        if self.search_index:
+            self.search_index.add(products)
+        if not normalize:
+            return {
+                'products': products,
+                'next_page': self.get_next_page(data)
+            }
+        products = self.normalize_products(products)
         if filter_event:
-            # filter out and only return products with event_status in filter_event
-            products = [x for x in products if x['event_status'] in filter_event]
+            # filter out and only return products with event status in filter_event
+            products = [x for x in products if x.status in filter_event]
 
         products_dict = {
             'products': products,
@@ -233,47 +530,251 @@ class Viaplay(object):
 
         return products_dict
 
-    def get_channels(self, url):
-        data = self.make_request(url, method='get')
-        channels_block = data['_embedded']['viaplay:blocks'][0]['_embedded']['viaplay:blocks']
-        channels = [x['viaplay:channel'] for x in channels_block]
-        channels_dict = {
-            'channels': channels,
-            'next_page': self.get_next_page(data)
+    def iter_pages(self, url, search_query=None, page_size=None, prefetch=True):
+        """Yield the products dict of each page, lazily following the next page links.
+        With prefetch, the following page is fetched in the background while the caller handles the current one.
+        page_size asks the endpoint for bigger pages, endpoints that don't support it ignore it."""
+        if page_size:
+            url = self.set_page_size(url, page_size)
+        if not prefetch:
+            while url:
+                products_dict = self.get_products(url, search_query=search_query)
+                yield products_dict
+                url = products_dict['next_page']
+                search_query = None  # the next page links include the query
+            return
+
+        from concurrent.futures import ThreadPoolExecutor  # deferred, slow to import
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(self.get_products, url, search_query=search_query)
+            while future:
+                products_dict = future.result()
+                if products_dict['next_page']:
+                    future = executor.submit(self.get_products, products_dict['next_page'])
+                else:
+                    future = None
+                yield products_dict
+        finally:
+            executor.shutdown(wait=False)  # don't block a caller that stopped early
+
+    def iter_products(self, url, search_query=None, page_size=None, prefetch=True):
+        """Yield the products of all pages. Stop iterating to stop fetching."""
+        for products_dict in self.iter_pages(url, search_query, page_size, prefetch):
+            for product in products_dict['products']:
+                yield product
+
+    def get_product_listing(self, url, min_items=0, search_query=None, page_size=None):
+        """Return a products dict with whole pages of products until there are at least min_items.
+        next_page is the first page that wasn't included. A page is only fetched once it's known to be needed,
+        there's nothing to overlap the download with here."""
+        listing = {
+            'products': [],
+            'next_page': False
+        }
+        pages = self.iter_pages(url, search_query, page_size, prefetch=False)
+        for products_dict in pages:
+            listing['products'].extend(products_dict['products'])
+            listing['next_page'] = products_dict['next_page']
+            if len(listing['products']) >= min_items:
+                break
+        pages.close()
+
+        return listing
+
+    @staticmethod
+    def set_page_size(url, page_size):
+        """Return url with the pageSize query parameter set. A URL that already has it is returned as is,
+        so the next page links keep matching the cached and prefetched pages."""
+        parts = urlsplit(re.sub(r'\{.+?\}', '', url))  # drop the URL templates like parse_url does
+        query = parse_qsl(parts.query)
+        if ('pageSize', str(page_size)) in query:
+            return url
+        query = [x for x in query if x[0] != 'pageSize']
+        query.append(('pageSize', str(page_size)))
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    def search_local(self, query):
+        """Search the products seen so far. Return a list of products, best match first."""
+        if not self.search_index:
+            return []
+        return self.normalize_products(self.search_index.search(query))
+
+    def normalize_products(self, products):
+        """Turn raw API products into Product objects, all using the same clock snapshot."""
+        now = datetime.utcnow()
+        today = datetime.now().date()
+        return [self.normalize_product(x, now, today) for x in products]
+
+    def normalize_product(self, data, now, today):
+        """Collect everything the listings need from a raw product in a single pass."""
+        product = Product(data['type'])
+        system = data.get('system', {})
+        links = data.get('_links', {})
+        content = data.get('content', {})
+        series = content.get('series', {})
+        product.guid = system.get('guid')
+        product.flags = system.get('flags', [])
+        product.url = links.get('self', {}).get('href')
+        product.page_url = links.get('viaplay:page', {}).get('href')
+        product.genre = ', '.join([x['title'] for x in links.get('viaplay:genres', [])])
+
+        product.title = content.get('title')
+        product.plot = content.get('synopsis') or series.get('synopsis')
+        product.year = content.get('production', {}).get('year')
+        product.mpaa = content.get('parentalRating')
+        product.format = content.get('format', {}).get('title')
+        if 'duration' in content:
+            product.duration = int(content['duration']['milliseconds']) // 1000
+        people = content.get('people', {})
+        product.cast = people.get('actors', [])
+        product.director = ', '.join(people.get('directors', []))
+        if 'imdb' in content:
+            product.rating = float(content['imdb']['rating']) if content['imdb'].get('rating') else None
+            product.votes = str(content['imdb'].get('votes'))
+            product.code = content['imdb'].get('id')
+
+        if series:
+            product.series_title = series.get('title')
+            product.episode_title = series.get('episodeTitle')
+            if series.get('seasons'):
+                product.seasons = int(series['seasons'])
+            if series.get('season', {}).get('seasonNumber'):
+                product.season = int(series['season']['seasonNumber'])
+            if series.get('episodeNumber'):
+                product.episode = int(series['episodeNumber'])
+
+        product.art = self.get_art(content.get('images', {}), product.type)
+
+        if 'epg' in data:
+            epg = data['epg']
+            product.start = self.parse_datetime(epg.get('startTime') or epg['start'])
+            product.end = self.parse_datetime(epg.get('endTime') or epg['end'])
+            product.start_local = self.utc_to_local(product.start)
+            product.is_today = product.start_local.date() == today
+            product.status = self.event_status(product.start.replace(tzinfo=None), product.end.replace(tzinfo=None),
+                                               product.flags, now)
+        if 'catchupAvailability' in system:
+            catchup_end = self.parse_datetime(system['catchupAvailability']['end']).replace(tzinfo=None)
+            product.expired = now > catchup_end
+
+        return product
+
+    def get_art(self, images, product_type):
+        """Map the image templates of a product to Kodi artwork, sized for each artwork role."""
+        artwork = {}
+        resolve = self.artwork.resolve
+        if product_type == 'tvEvent':  # only the landscape image is used for TV events
+            if 'landscape' in images:
+                template = images['landscape']['template']
+                artwork['thumb'] = resolve(template, 'thumb', 'landscape')
+                artwork['fanart'] = resolve(template, 'fanart', 'landscape')
+            return artwork
+
+        for image_type in images:
+            template = images[image_type]['template']
+            if image_type == 'landscape':
+                if product_type in ('episode', 'sport'):
+                    artwork['thumb'] = resolve(template, 'thumb', image_type)
+                artwork['banner'] = resolve(template, 'banner', image_type)
+            elif image_type == 'hero169':
+                artwork['fanart'] = resolve(template, 'fanart', image_type)
+            elif image_type == 'coverart23':
+                if product_type != 'sport':
+                    artwork['poster'] = resolve(template, 'poster', image_type)
+            elif image_type == 'coverart169':
+                artwork['cover'] = resolve(template, 'cover', image_type)
+            elif image_type == 'boxart':
+                if product_type not in ('episode', 'sport'):
+                    artwork['thumb'] = resolve(template, 'thumb', image_type)
+
+        return artwork
+
+    def get_channel_art(self, channel):
+        """Return the Kodi artwork of a channel, its logo."""
+        images = channel['content']['images']
+        template = images['fallback']['template'] if 'fallback' in images else images['logo']['template']
+        return {
+            'thumb': self.artwork.resolve(template, 'logo'),
+            'fanart': self.artwork.resolve(template, 'logo')
         }
 
+    def get_channels(self, url):
+        """Return a dict containing the channels and next page if available.
+        The embedded programs of each channel are indexed in channel['epg_index'] and the artwork is in channel['art'].
+        Pages are served from the local EPG store while its schedules are fresh."""
+        url = self.parse_url(url)
+        now = time.time()
+        channels_dict = self.epg_store.get_page(url, now)
+        if channels_dict:
+            self.log('EPG store hit: %s', url)
+        else:
+            data = self.make_request(url, method='get', paths=self.get_page_paths('channels'))
+            channels_block = data['_embedded']['viaplay:blocks'][0]['_embedded']['viaplay:blocks']
+            channels_dict = {
+                'channels': [x['viaplay:channel'] for x in channels_block],
+                'next_page': self.get_next_page(data)
+            }
+            self.epg_store.store_page(url, channels_dict, now)
+        for channel in channels_dict['channels']:
+            channel['epg_index'] = EpgIndex(channel['_embedded']['viaplay:products'])
+            channel['art'] = self.get_channel_art(channel)
+
         return channels_dict
 
     def get_seasons(self, url):
         """Return all available series seasons."""
-        data = self.make_request(url=url, method='get')
-        return [x for x in data['_embedded']['viaplay:blocks'] if x['type'] == 'season-list']
-
-    def download_subtitles(self, suburls):
-        """Download the SAMI subtitles, decode the HTML entities and save to temp directory.
-        Return a list of the path to the downloaded subtitles."""
-        paths = []
-        for sub_data in suburls:
-            sami = self.make_request(url=sub_data['href'], method='get').decode('utf-8', 'ignore').strip()
-            htmlparser = HTMLParser.HTMLParser()
-            subtitle = htmlparser.unescape(sami).encode('utf-8')
-            path = os.path.join(self.tempdir, '{0}.sami'.format(sub_data['languageCode']))
-            with open(path, 'wb') as subfile:
-                subfile.write(subtitle)
-            paths.append(path)
-
-        return paths
+        data = self.make_request(url=url, method='get', paths=self.get_page_paths('seasons'))
+        return [x for x in data.get('_embedded', {}).get('viaplay:blocks', []) if x['type'] == 'season-list']
 
-    def get_deviceid(self):
-        """"Read/write deviceId (generated UUID4) from/to file and return it."""
+    def get_all_episodes(self, season_urls, workers=4):
+        """Return the episodes of all pages of all seasons in season and episode order.
+        The seasons are fetched concurrently, their pages one after another."""
+        from concurrent.futures import ThreadPoolExecutor  # deferred, slow to import
+
+        def get_season(url):
+            return list(self.iter_products(url, prefetch=False))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            seasons = list(executor.map(get_season, season_urls))
+        episodes = [x for season in seasons for x in season]
+        episodes.sort(key=lambda x: (x.season or 0, x.episode or 0))
+
+        return episodes
+
+    def download_subtitles(self, suburls, workers=4):
+        """Download the SAMI subtitles concurrently and convert them to subtitle_format.
+        Return a list of the paths to the subtitles. Subtitles that fail to download are left out."""
+        if len(suburls) < 2:
+            paths = [self.download_subtitle(x) for x in suburls]
+        else:
+            from concurrent.futures import ThreadPoolExecutor  # deferred, slow to import
+            with ThreadPoolExecutor(max_workers=min(workers, len(suburls))) as executor:
+                paths = list(executor.map(self.download_subtitle, suburls))
+
+        return [x for x in paths if x]
+
+    def download_subtitle(self, sub_data):
+        """Return the path of a converted subtitle. Subtitles are converted while they download
+        and kept in the subtitle cache, so a replay doesn't download them again."""
+        url = sub_data['href']
+        path = self.subtitle_cache.get(url, self.subtitle_format)
+        if path:
+            self.log('Subtitle cache hit: %s', url)
+            return path
+        self.log('Downloading subtitle: %s', url)
         try:
-            with open(self.deviceid_file, 'r') as deviceid:
-                return deviceid.read()
-        except IOError:
-            deviceid = str(uuid.uuid4())
-            with open(self.deviceid_file, 'w') as idfile:
-                idfile.write(deviceid)
-            return deviceid
+            req = self.http_session.get(url, stream=True, timeout=self.get_timeout(url))
+            req.raise_for_status()
+            return self.subtitle_cache.add(url, sub_data['languageCode'], req.iter_content(16384),
+                                           self.subtitle_format)
+        except self.request_error as error:
+            self.log('Failed to download subtitle %s: %s', url, error)
+            return None
+
+    def get_deviceid(self):
+        """Return the deviceId (generated UUID4) of this installation."""
+        return self.session.get_device_id()
 
     def get_event_status(self, data):
         """Return whether the event/program is live/upcoming/archive."""
@@ -287,7 +788,12 @@ class Viaplay(object):
         start_time_obj = self.parse_datetime(start_time).replace(tzinfo=None)
         end_time_obj = self.parse_datetime(end_time).replace(tzinfo=None)
 
-        if 'isLive' in data['system']['flags']:
+        return self.event_status(start_time_obj, end_time_obj, data['system']['flags'], now)
+
+    @staticmethod
+    def event_status(start_time_obj, end_time_obj, flags, now):
+        """Return live/upcoming/archive for naive UTC start and end times."""
+        if 'isLive' in flags:
             status = 'live'
         elif now >= start_time_obj and now < end_time_obj:
             status = 'live'
@@ -315,6 +821,7 @@ class Viaplay(object):
 
     def parse_datetime(self, iso8601_string, localize=False):
         """Parse ISO8601 string to datetime object."""
+        import iso8601  # deferred, only needed for events and programs
         datetime_obj = iso8601.parse_date(iso8601_string)
         if localize:
             return self.utc_to_local(datetime_obj)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from resources.lib.jsonstream import JsonExtractor, extract, iter_chunks, parse_path
+
+
+def chunked(document, size):
+    return iter_chunks(json.dumps(document).encode('utf-8'), size)
+
+
+class ParsePathTest(unittest.TestCase):
+    def test_steps(self):
+        self.assertEqual(parse_path('_embedded.viaplay:blocks[*].{type, _links}[0]'),
+                         ('_embedded', 'viaplay:blocks', '*', frozenset(['type', '_links']), 0))
+
+
+class ExtractTest(unittest.TestCase):
+    document = {
+        'type': 'page',
+        'padding': ['skip {me} [please]', {'nested': [1, 2, {'deep': 'x'}]}, 'quote \\" and ] bracket'],
+        '_embedded': {
+            'viaplay:blocks': [
+                {'type': 'list', 'title': 'First åäö \\"quoted\\"', 'extra': {'a': [1]}},
+                {'type': 'grid', 'title': 'Second', 'extra': []},
+                {'type': 'list', 'title': 'Third {not a bracket}', 'empty': {}}
+            ]
+        },
+        'success': True
+    }
+    paths = ('type', '_embedded.viaplay:blocks[*].{type,title}')
+    expected = {
+        'type': 'page',
+        '_embedded': {
+            'viaplay:blocks': [
+                {'type': 'list', 'title': 'First åäö \\"quoted\\"'},
+                {'type': 'grid', 'title': 'Second'},
+                {'type': 'list', 'title': 'Third {not a bracket}'}
+            ]
+        }
+    }
+
+    def test_every_chunk_size(self):
+        """Chunk boundaries fall inside strings, escapes, literals and between tokens."""
+        for size in range(1, 40):
+            self.assertEqual(extract(chunked(self.document, size), self.paths), self.expected, size)
+
+    def test_escaped_keys(self):
+        document = {'a\\"b': {'cé': 1}, 'other': 2}
+        self.assertEqual(extract(chunked(document, 3), ('a\\"b.cé',)), {'a\\"b': {'cé': 1}})
+
+    def test_index_path(self):
+        result = extract(chunked(self.document, 7), ('_embedded.viaplay:blocks[1].title',))
+        self.assertEqual(result, {'_embedded': {'viaplay:blocks': [{'title': 'Second'}]}})
+
+    def test_nested_capture_keeps_whole_value(self):
+        result = extract(chunked(self.document, 5), ('padding[1]',))
+        self.assertEqual(result, {'padding': [{'nested': [1, 2, {'deep': 'x'}]}]})
+
+    def test_empty_containers(self):
+        document = {'a': [], 'b': {}, 'c': [{}, []], 'd': {'e': []}}
+        for size in (1, 2, 64):
+            self.assertEqual(extract(chunked(document, size), ('a', 'b', 'd.e')), {'a': [], 'b': {}, 'd': {'e': []}})
+            # containers that are descended into but have nothing to extract are left out
+            self.assertEqual(extract(chunked(document, size), ('c[*].x', 'd.e[*]')), {})
+
+    def test_literals(self):
+        document = {'t': True, 'f': False, 'n': None, 'i': -12, 'x': 1.5e3, 'skip': [True, None, 3]}
+        for size in (1, 3, 64):
+            self.assertEqual(extract(chunked(document, size), ('t', 'f', 'n', 'i', 'x')),
+                             {'t': True, 'f': False, 'n': None, 'i': -12, 'x': 1.5e3})
+
+    def test_values_in_document_order(self):
+        values = list(JsonExtractor(chunked(self.document, 4), ('_embedded.viaplay:blocks[*].title',)))
+        self.assertEqual([x[0] for x in values], [('_embedded', 'viaplay:blocks', i, 'title') for i in range(3)])
+
+    def test_unterminated(self):
+        with self.assertRaises(ValueError):
+            extract([b'{"a": "never ends'], ('a',))
+        with self.assertRaises(ValueError):
+            extract([b'{"a": [1, 2'], ('b',))
+
+
+if __name__ == '__main__':
+    unittest.main()
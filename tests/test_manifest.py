@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import unittest
+import xml.etree.ElementTree as ET
+
+from resources.lib.manifest import ManifestFilter, tag
+
+MANIFEST = b'''<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static">
+  <Period>
+    <AdaptationSet contentType="video">
+      <SegmentTemplate media="video/$RepresentationID$/$Number$.m4s" initialization="video/$RepresentationID$/init.mp4"/>
+      <Representation id="high" bandwidth="5000000" height="1080"/>
+      <Representation id="low" bandwidth="1000000" height="540"/>
+    </AdaptationSet>
+    <AdaptationSet contentType="audio" lang="sv">
+      <Representation id="audio" bandwidth="128000">
+        <BaseURL>audio.mp4</BaseURL>
+        <SegmentBase indexRange="0-99"/>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="text" lang="sv">
+      <Representation id="subs" bandwidth="1000">
+        <BaseURL>https://subs.example.com/sv.vtt</BaseURL>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>'''
+
+
+def apply(manifest, url, **kwargs):
+    return ET.fromstring(ManifestFilter(**kwargs).apply(manifest, url))
+
+
+class ManifestFilterTest(unittest.TestCase):
+    def test_keeps_query_on_segment_urls(self):
+        root = apply(MANIFEST, 'https://cdn.example.com/asset/manifest.mpd?token=a$b&exp=1')
+        self.assertEqual(root.find(tag('BaseURL')).text, 'https://cdn.example.com/asset/')
+        template = root.find('.//' + tag('SegmentTemplate'))
+        self.assertEqual(template.get('media'), 'video/$RepresentationID$/$Number$.m4s?token=a$$b&exp=1')
+        self.assertEqual(template.get('initialization'), 'video/$RepresentationID$/init.mp4?token=a$$b&exp=1')
+        base_urls = [x.text for x in root.iter(tag('BaseURL'))]
+        self.assertIn('audio.mp4?token=a$b&exp=1', base_urls)
+        # the token isn't sent to other hosts
+        self.assertIn('https://subs.example.com/sv.vtt', base_urls)
+
+    def test_without_query(self):
+        root = apply(MANIFEST, 'https://cdn.example.com/asset/manifest.mpd')
+        self.assertEqual(root.find('.//' + tag('SegmentTemplate')).get('media'), 'video/$RepresentationID$/$Number$.m4s')
+        self.assertIn('audio.mp4', [x.text for x in root.iter(tag('BaseURL'))])
+
+    def test_existing_base_url(self):
+        manifest = MANIFEST.replace(b'<Period>', b'<BaseURL>https://other.example.com/dash/</BaseURL><Period>')
+        root = apply(manifest, 'https://cdn.example.com/asset/manifest.mpd?token=a')
+        self.assertEqual(root.find(tag('BaseURL')).text, 'https://other.example.com/dash/')
+        self.assertEqual(root.find('.//' + tag('SegmentTemplate')).get('media'), 'video/$RepresentationID$/$Number$.m4s')
+
+    def test_filter_video(self):
+        root = apply(MANIFEST, 'https://cdn.example.com/asset/manifest.mpd', max_height=720)
+        self.assertEqual([x.get('id') for x in root.iter(tag('Representation'))], ['low', 'audio', 'subs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from resources.lib.prefetch import Prefetcher
+
+
+class FailingViaplay(object):
+    def prefetch(self, url):
+        raise IOError('offline')
+
+
+class PrefetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.messages = []
+        self.prefetcher = Prefetcher(FailingViaplay, self.messages.append, os.path.join(self.folder, 'history.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_visits_rank_candidates_with_a_page_size(self):
+        self.prefetcher.record_visit('https://content.viaplay.se/pc-se/serier/drama?sort=recent{&blockId}')
+        self.prefetcher.record_visit('https://content.viaplay.se/pc-se/serier/drama?sort=recent&pageSize=40')
+        self.prefetcher.add('https://content.viaplay.se/pc-se/film/drama?pageSize=100', 2)
+        self.prefetcher.add('https://content.viaplay.se/pc-se/serier/drama?sort=recent&pageSize=100', 1)
+        self.assertEqual(self.prefetcher.ranked()[0],
+                         'https://content.viaplay.se/pc-se/serier/drama?sort=recent&pageSize=100')
+
+    def test_failed_fetch_is_logged(self):
+        self.prefetcher.fetch('https://content.viaplay.se/pc-se/film')
+        self.assertEqual(self.prefetcher.downloaded, 0)
+        self.assertEqual(len(self.messages), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from resources.lib.searchindex import SearchIndex, tokenize
+
+
+def make_product(guid, title, actors=()):
+    return {'type': 'movie', 'system': {'guid': guid},
+            'content': {'title': title, 'people': {'actors': list(actors)}}}
+
+
+def guids(products):
+    return [x['system']['guid'] for x in products]
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_folds_accents(self):
+        self.assertEqual(tokenize('Bjørn Ålander, Straße!'), ['bjorn', 'alander', 'strasse'])
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.index = SearchIndex(os.path.join(self.folder, 'search.db'))
+
+    def tearDown(self):
+        self.index.conn.close()
+        shutil.rmtree(self.folder)
+
+    def test_changed_product_is_reindexed(self):
+        self.index.add([make_product('1', 'Old Title', ['Anna Berg'])])
+        self.index.add([make_product('1', 'New Title', ['Anna Berg'])])
+        self.assertEqual(guids(self.index.search('new')), ['1'])
+        self.assertEqual(self.index.search('old'), [])
+        self.assertEqual(self.index.search('New Title')[0]['content']['title'], 'New Title')
+
+    def test_many_products(self):
+        products = [make_product(str(i), 'Title %d' % i) for i in range(2500)]
+        self.index.add(products)
+        self.index.add(products)
+        self.assertEqual(guids(self.index.search('2499')), ['2499'])
+        self.assertEqual(len(self.index.search('title', limit=2000)), 2000)
+
+    def test_typo(self):
+        self.index.add([make_product('1', 'Midsommar')])
+        self.assertEqual(guids(self.index.search('midsomar')), ['1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from http.cookiejar import Cookie
+
+from resources.lib.session import SessionState
+
+
+def make_cookie(name, value, domain='.viaplay.se'):
+    return Cookie(0, name, value, None, False, domain, True, True, '/', True, False, 2000000000, False, None, None,
+                  {})
+
+
+def cookies(session):
+    return sorted((c.name, c.value) for c in session.cookie_jar)
+
+
+class SessionStateTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        first = SessionState(self.folder)
+        first.cookie_jar.set_cookie(make_cookie('session', 'old'))
+        first.cookie_jar.set_cookie(make_cookie('consent', 'yes'))
+        first.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_save_only_when_changed(self):
+        session = SessionState(self.folder)
+        self.assertFalse(session.save())
+        session.cookie_jar.set_cookie(make_cookie('session', 'new'))
+        self.assertTrue(session.save())
+        self.assertEqual(cookies(SessionState(self.folder)), [('consent', 'yes'), ('session', 'new')])
+
+    def test_stale_jars_keep_each_others_changes(self):
+        refreshing = SessionState(self.folder)
+        other = SessionState(self.folder)
+        refreshing.cookie_jar.set_cookie(make_cookie('session', 'new'))
+        refreshing.save()
+        other.cookie_jar.set_cookie(make_cookie('bm', 'x'))
+        other.save()
+        self.assertEqual(cookies(SessionState(self.folder)), [('bm', 'x'), ('consent', 'yes'), ('session', 'new')])
+        self.assertEqual(cookies(other), [('bm', 'x'), ('consent', 'yes'), ('session', 'new')])
+
+    def test_removed_cookie_is_not_brought_back(self):
+        logging_out = SessionState(self.folder)
+        other = SessionState(self.folder)
+        logging_out.cookie_jar.clear('.viaplay.se', '/', 'session')
+        logging_out.save()
+        other.cookie_jar.set_cookie(make_cookie('bm', 'x'))
+        other.save()
+        self.assertEqual(cookies(SessionState(self.folder)), [('bm', 'x'), ('consent', 'yes')])
+
+
+if __name__ == '__main__':
+    unittest.main()